@@ -10,42 +10,88 @@
 #
 
 import argparse
-import cv2
 import datetime
 import subprocess
 
-from skimage.metrics import structural_similarity,mean_squared_error
-from termcolor import colored, cprint
-
 import ofl,os
 
+# hands over to the 'ofl.py serve' daemon when running
+ofl.delegate(__file__)
+
+import contextlib
+import json
+import sys
+
+import images
+
+from termcolor import colored, cprint
+
 parser = argparse.ArgumentParser()
 parser.add_argument("-t", "--threshold", type=int, help = "minimum threshold proving image similarity", default=100)
 parser.add_argument("-v", "--verbosity", type=int, help = "Increase verbosity", choices=[ofl.SILENT,ofl.ERROR,ofl.WARN,ofl.INFO,ofl.DEBUG],default=ofl.ERROR)
-parser.add_argument("images", help="Images to test", nargs=2)
+parser.add_argument("-b", "--batch", type=str, help = "compares the 'old new [threshold]' pairs listed one per line in this manifest ('-' for stdin) emitting a JSON result per pair", metavar="MANIFEST")
+parser.add_argument("-d", "--diff", action='store_true', help = "writes the heatmap of dissimilar images as 'diff-<new image>' outlining the changed regions")
+parser.add_argument("-g", "--golden", action='store_true', help = "the old images are the targets in the git index: similar targets are restored from git removing the new image, dissimilar ones are removed leaving the new image for inspection")
+parser.add_argument("--promote", action='store_true', help = "in golden mode, the new image replaces a dissimilar target without failing")
+parser.add_argument("-j", "--jobs", type=int, help = "number of concurrent comparisons in batch mode", default=os.cpu_count())
+parser.add_argument("images", help="Images to test", nargs='*')
 
 args = parser.parse_args()
 
 ofl.verbosity = args.verbosity
 
+if args.batch:
+  if args.images:
+    ofl.error("no images are allowed in batch mode")
+    exit(1)
+  with (sys.stdin if args.batch=='-' else open(args.batch)) as manifest:
+    triples = list(images.pairs(manifest,args.threshold))
+  failed  = 0
+  tiers   = {tier: [0,0] for tier in images.TIERS}
+  with images.Golden() if args.golden else contextlib.nullcontext() as store:
+    results = list(images.batch(triples,args.jobs,args.diff,store,args.promote)) if store else images.batch(triples,args.jobs,args.diff)
+  for result in results:
+    print(json.dumps(result),flush=True)
+    failed += not result['passed'] and result.get('action')!='promoted'
+    if 'tier' in result:
+      tiers[result['tier']][0] += 1
+      tiers[result['tier']][1] += result['elapsed']
+  ofl.info(f"{len(triples)-failed}/{len(triples)} pairs similar")
+  for tier, (count, elapsed) in tiers.items():
+    ofl.info(f"{tier}: {count} pairs decided in {elapsed:.3f}s")
+  exit(1 if failed else 0)
+
 num_images  = len(args.images)
-if num_images>2:
-  ofl.error("max two images are allowed")
+if num_images!=2:
+  ofl.error("two images are expected")
   exit(1)
 
 first   = args.images[0]
 second  = args.images[1]
 ofl.info(f"comparing '{first}' with '{second}'")
 
-img1    = cv2.imread(first)
-img2    = cv2.imread(second)
-
-img1_gray = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-img2_gray = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
-
 # Compute SSIM between two images
-score = round(structural_similarity(img1_gray, img2_gray)*100)
-if score<args.threshold:
+if args.golden:
+  with images.Golden() as store:
+    result = images.golden(first,second,store.reference(first),args.threshold,args.promote,args.diff)
+  ofl.info(f"'{first}' {result['action']}")
+  if 'score' not in result and 'error' not in result:
+    exit(0)
+else:
+  result  = images.compare(first,second,args.threshold,args.diff)
+if 'error' in result:
+  if result.get('action')=='promoted':
+    ofl.warn(result['error'])
+    exit(0)
+  ofl.error(result['error'])
+  exit(1)
+score   = result['score']
+ofl.info(f"decided by '{result['tier']}' tier")
+for x, y, w, h in result.get('regions',[]):
+  ofl.info(f"changed region {w}x{h} at ({x},{y})")
+if 'heatmap' in result:
+  ofl.info(f"heatmap written in '{result['heatmap']}'")
+if score<args.threshold and result.get('action')!='promoted':
   cprint(f'{score}%','red',end=" ")
   # ofl.error(f"insufficient {score}% similarity")
   exit(1)
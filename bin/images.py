@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+#
+# Image comparison shared by image-diff.py and the OFL picture tools
+#
+# This file is part of the 'OpenSCAD Foundation Library' (OFL) project.
+#
+# Copyright © 2021, Giampiero Gabbiani <giampiero@gabbiani.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+import filecmp, multiprocessing, os, shlex, subprocess, tempfile, time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy
+
+# tiers deciding a comparison, cheapest first
+TIERS   = ('bytes','pixels','preview','ssim')
+# downscale factor of the preview tier
+PREVIEW = 4
+# SSIM window side and constants (Wang et al. 2004)
+WINDOW  = 7
+K1, K2  = 0.01, 0.03
+
+def ssim_map(img1, img2, data_range=255):
+  '''
+  returns the float32 structural similarity map of the «img1» and «img2»
+  grayscale images. The local means of the images, of their squares and of
+  their product come from a single box filter pass over the five channels
+  stacked together.
+  '''
+  x       = img1.astype(numpy.float32)
+  y       = img2.astype(numpy.float32)
+  ux, uy, uxx, uyy, uxy = cv2.split(cv2.boxFilter(cv2.merge([x,y,x*x,y*y,x*y]), -1, (WINDOW,WINDOW), borderType=cv2.BORDER_REFLECT))
+  # sample covariance normalization
+  norm    = WINDOW**2/(WINDOW**2-1)
+  vx      = norm*(uxx-ux*ux)
+  vy      = norm*(uyy-uy*uy)
+  vxy     = norm*(uxy-ux*uy)
+  c1      = (K1*data_range)**2
+  c2      = (K2*data_range)**2
+  return ((2*ux*uy+c1)*(2*vxy+c2))/((ux*ux+uy*uy+c1)*(vx+vy+c2))
+
+def score(smap):
+  '''
+  returns the mean structural similarity percentage of «smap», excluding the
+  borders affected by the window padding
+  '''
+  pad = WINDOW//2
+  return round(float(smap[pad:-pad,pad:-pad].mean())*100)
+
+def ssim(img1, img2):
+  '''
+  returns the mean structural similarity percentage of the «img1» and «img2»
+  grayscale images
+  '''
+  return score(ssim_map(img1, img2))
+
+def contents(image):
+  '''
+  returns the bytes of «image», either a file name or the bytes themselves
+  '''
+  if isinstance(image,bytes):
+    return image
+  with open(image,'rb') as file:
+    return file.read()
+
+def name(image):
+  return image if isinstance(image,str) else f'<{len(image)} bytes>'
+
+def read(first, second):
+  '''
+  returns the decoded «first» and «second» images (file names or bytes)
+  checking they are comparable
+  '''
+  img1  = cv2.imdecode(numpy.frombuffer(contents(first),numpy.uint8), cv2.IMREAD_COLOR)
+  img2  = cv2.imdecode(numpy.frombuffer(contents(second),numpy.uint8), cv2.IMREAD_COLOR)
+  if img1 is None or img2 is None:
+    raise ValueError(f"unable to decode '{name(first) if img1 is None else name(second)}'")
+  if img1.shape!=img2.shape:
+    raise ValueError(f"'{name(first)}' and '{name(second)}' size mismatch")
+  return img1, img2
+
+def gray(img):
+  return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+def similarity(first, second, threshold=100, detail=False):
+  '''
+  returns the percentage of structural similarity between the «first» and
+  «second» images (file names or bytes) together with the tier that decided it. Cheap tiers
+  decide first: byte identical files, identical pixels and finally a
+  downscaled SSIM preview. Downscaling smooths differences but may also score
+  lower than full resolution, so the preview only accepts when halfway from
+  «threshold» to 100: full resolution SSIM decides every other case.
+  With «detail» the full resolution SSIM map and the decoded «second» image
+  are returned too (None when not computed).
+  '''
+  if filecmp.cmp(first,second,shallow=False) if isinstance(first,str) and isinstance(second,str) else contents(first)==contents(second):
+    return (100, 'bytes', None, None) if detail else (100, 'bytes')
+  img1, img2 = read(first,second)
+  if numpy.array_equal(img1,img2):
+    return (100, 'pixels', None, img2) if detail else (100, 'pixels')
+  img1_gray = gray(img1)
+  img2_gray = gray(img2)
+  if min(img1_gray.shape)>=WINDOW*PREVIEW:
+    preview = ssim(*(cv2.resize(img, None, fx=1/PREVIEW, fy=1/PREVIEW, interpolation=cv2.INTER_AREA) for img in (img1_gray,img2_gray)))
+    if preview>=(threshold+100)/2:
+      return (preview, 'preview', None, img2) if detail else (preview, 'preview')
+  smap = ssim_map(img1_gray, img2_gray)
+  return (score(smap), 'ssim', smap, img2) if detail else (score(smap), 'ssim')
+
+def regions(smap, threshold=100):
+  '''
+  returns the [x,y,width,height] bounding boxes of the «smap» regions less
+  similar than «threshold», largest first
+  '''
+  mask      = (smap<threshold/100).astype(numpy.uint8)
+  # merges the fragments of the same change
+  mask      = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, numpy.ones((WINDOW,WINDOW),numpy.uint8))
+  contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+  boxes     = [list(cv2.boundingRect(contour)) for contour in contours]
+  return sorted(boxes, key=lambda box: box[2]*box[3], reverse=True)
+
+def heatmap(smap, img, boxes, fname):
+  '''
+  writes in «fname» the dissimilarity heatmap of «smap» blended over «img» with
+  the changed region «boxes» outlined
+  '''
+  heat    = cv2.applyColorMap(((1-numpy.clip(smap,0,1))*255).astype(numpy.uint8), cv2.COLORMAP_JET)
+  result  = cv2.addWeighted(img, 0.5, heat, 0.5, 0)
+  for x, y, w, h in boxes:
+    cv2.rectangle(result, (x,y), (x+w-1,y+h-1), (0,0,255), 1)
+  cv2.imwrite(fname, result)
+
+def compare(old, new, threshold=100, diff=False):
+  '''
+  returns the machine readable result of comparing «old» with «new» including
+  the deciding tier and the elapsed seconds: errors are reported in the result
+  instead of being raised. Dissimilar pairs report the changed regions too,
+  with their heatmap written as 'diff-<new>' when «diff» is set.
+  '''
+  result  = {'old': name(old), 'new': name(new), 'threshold': threshold}
+  start   = time.perf_counter()
+  try:
+    result['score'], result['tier'], smap, img2 = similarity(old,new,threshold,detail=True)
+    result['passed']  = result['score']>=threshold
+    if not result['passed']:
+      # the map of the deciding 'ssim' tier is reused
+      if smap is None:
+        img1, img2      = read(old,new)
+        smap            = ssim_map(gray(img1),gray(img2))
+      result['regions'] = regions(smap,threshold)
+      if diff:
+        result['heatmap'] = os.path.join(os.path.dirname(new),'diff-'+os.path.basename(new))
+        heatmap(smap,img2,result['regions'],result['heatmap'])
+  except (OSError, ValueError, cv2.error) as e:
+    result['passed']  = False
+    result['error']   = str(e)
+  result['elapsed'] = round(time.perf_counter()-start,4)
+  return result
+
+class Golden:
+  '''
+  Reference pictures in «rev» (the index by default, as 'git checkout --'
+  did), read in memory through a single 'git cat-file --batch' process: no
+  git process per picture and no index lock serializing the comparisons.
+  '''
+  def __init__(self, rev=''):
+    self.rev      = rev
+    self.root     = None
+    self.process  = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exception):
+    self.close()
+
+  def close(self):
+    if self.process:
+      self.process.stdin.close()
+      self.process.wait()
+      self.process = None
+
+  def read(self, fname):
+    '''
+    returns the contents of «fname» in «rev» (None when missing there)
+    '''
+    if not self.process:
+      self.root     = os.path.realpath(subprocess.run(['git','rev-parse','--show-toplevel'],cwd=os.path.dirname(os.path.abspath(fname)),capture_output=True,text=True,check=True).stdout.strip())
+      self.process  = subprocess.Popen(['git','cat-file','--batch'],cwd=self.root,stdin=subprocess.PIPE,stdout=subprocess.PIPE)
+    self.process.stdin.write(f'{self.rev}:{os.path.relpath(os.path.realpath(fname),self.root)}\n'.encode())
+    self.process.stdin.flush()
+    header  = self.process.stdout.readline().split()
+    if len(header)!=3:
+      return None
+    data    = self.process.stdout.read(int(header[2]))
+    self.process.stdout.read(1)
+    return data
+
+  def reference(self, fname):
+    '''
+    returns the contents of «fname» in «rev» or the current ones when missing
+    there (None when neither exists)
+    '''
+    data = self.read(fname)
+    return data if data is not None or not os.path.isfile(fname) else contents(fname)
+
+def write(fname, data):
+  '''
+  atomically replaces «fname» with «data»
+  '''
+  fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fname)),prefix='.'+os.path.basename(fname))
+  with os.fdopen(fd,'wb') as file:
+    file.write(data)
+  os.replace(temp,fname)
+
+def golden(target, new, old, threshold=100, promote=False, diff=False):
+  '''
+  compares the «new» rendering of «target» with its «old» reference contents
+  (None when missing) and settles the files accordingly:
+
+  - similar: «target» holds the reference contents (rewritten only when
+    different) and «new» is removed;
+  - dissimilar or not comparable (size mismatch, decode failure): «new»
+    becomes «target» when «promote» is set, otherwise «target» is removed
+    leaving «new» for inspection;
+  - no reference: «new» always becomes «target».
+
+  The result reports the action taken.
+  '''
+  if old is None:
+    os.replace(new,target)
+    return {'old': target, 'new': new, 'threshold': threshold, 'passed': True, 'action': 'promoted'}
+  result        = compare(old,new,threshold,diff)
+  result['old'] = target
+  if result['passed']:
+    if not os.path.isfile(target) or contents(target)!=old:
+      write(target,old)
+    else:
+      os.utime(target)
+    os.remove(new)
+    result['action'] = 'kept'
+  elif promote:
+    os.replace(new,target)
+    result['action'] = 'promoted'
+  else:
+    if os.path.isfile(target):
+      os.remove(target)
+    result['action'] = 'rejected'
+  return result
+
+def pairs(lines, threshold=100):
+  '''
+  parses the (old,new,threshold) triples of a manifest: one pair per line with
+  an optional threshold overriding the «threshold» default. Blank lines and
+  '#' comments are skipped.
+  '''
+  for line in lines:
+    fields = shlex.split(line,comments=True)
+    if not fields:
+      continue
+    if len(fields) not in (2,3):
+      raise ValueError(f"bad manifest line '{line.rstrip()}'")
+    yield fields[0], fields[1], int(fields[2]) if len(fields)==3 else threshold
+
+def _compare(arguments):
+  return compare(*arguments)
+
+def _golden(arguments):
+  return golden(*arguments)
+
+def batch(triples, workers=None, diff=False, store=None, promote=False):
+  '''
+  compares the (old,new,threshold) «triples» on a pool of «workers» processes,
+  yielding the results in the same order. With a Golden «store» the old images
+  are the targets in its revision, read by this process and settled by golden().
+  '''
+  if store:
+    function  = _golden
+    arguments = [(old,new,store.reference(old),threshold,promote,diff) for old, new, threshold in triples]
+  else:
+    function  = _compare
+    arguments = [(old,new,threshold,diff) for old, new, threshold in triples]
+  workers = min(workers if workers else os.cpu_count(),len(arguments))
+  if workers<=1:
+    yield from map(function,arguments)
+    return
+  with ProcessPoolExecutor(workers,mp_context=multiprocessing.get_context('fork')) as pool:
+    yield from pool.map(function,arguments,chunksize=max(1,len(arguments)//(workers*4)))
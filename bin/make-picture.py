@@ -13,11 +13,19 @@ import argparse
 import dotenv
 import os
 import re
+import shlex
+import shutil
 import subprocess
 import sys
 
 import ofl
 
+# hands over to the 'ofl.py serve' daemon when running
+ofl.delegate(__file__)
+
+import cv2
+import images
+
 from termcolor import colored, cprint
 
 def cat(f_name):
@@ -29,28 +37,82 @@ def prologue(title,case=None):
   else:
     print((colored(title+": ", 'yellow')),end="",flush=True)
 
-def hires(lowres):
-  res = [int(num)*4 for num in lowres.split('x')]
+def hires(lowres, factor=4):
+  res = [int(num)*factor for num in lowres.split('x')]
   return str(res[0])+','+str(res[1])
 
+def size(resolution, native=False):
+  '''
+  returns the (width,height) pixels of «resolution», supersampled when «native»
+  '''
+  return tuple(int(num)*(4 if native else 1) for num in resolution.split('x'))
+
+def viewport(scad_f):
+  '''
+  true when «scad_f» assigns the $vp* viewport variables, that a wrapper
+  importing its mesh would lose
+  '''
+  with open(scad_f) as file:
+    return re.search(r'^\s*\$vp[rtdf]\s*=',file.read(),re.MULTILINE) is not None
+
+def views(lines, camera=None, projection=None):
+  '''
+  parses the (output,resolution,camera,projection) views of a manifest: one
+  'output resolution [camera [projection]]' view per line, with missing or '-'
+  camera and projection defaulted to «camera» and «projection». Blank lines
+  and '#' comments are skipped.
+  '''
+  for line in lines:
+    fields = shlex.split(line,comments=True)
+    if not fields:
+      continue
+    if not 2<=len(fields)<=4:
+      raise ValueError(f"bad view line '{line.rstrip()}'")
+    fields += ['-']*(4-len(fields))
+    yield fields[0], fields[1], camera if fields[2]=='-' else fields[2], projection if fields[3]=='-' else fields[3]
+
 parser = argparse.ArgumentParser()
 parser.add_argument("-c", "--camera", help = "OpenSCAD camera position")
+parser.add_argument(      "--no-cache", action='store_true', help = "always run OpenSCAD bypassing the result cache")
 parser.add_argument("-d", "--dry-run", action='store_true', help = "On screen dump only of the generated dot file")
 parser.add_argument("-p", "--projection", help = "(o)rtho or (p)erspective when exporting png")
-parser.add_argument("-t", "--temp-root", type=str, help = "Temporary directory path", choices=["/var/tmp","/tmp"],default="/tmp")
+parser.add_argument("-t", "--temp-root", type=str, help = "Temporary directory root where a private working directory is created (tmpfs when available by default)")
 parser.add_argument("-v", "--verbosity", type=int, help = "Increase verbosity", choices=[ofl.SILENT,ofl.ERROR,ofl.WARN,ofl.INFO,ofl.DEBUG],default=ofl.ERROR)
-parser.add_argument("--ofl-script", type=str, help="OpenSCAD script",required=True)
-parser.add_argument("-r","--resolution",type=str,help="target resolution in 'openscad' format i.e. 800x600",required=True)
-parser.add_argument("--render", action='store_true', help = "for full geometry evaluation when exporting png")
+parser.add_argument("--ofl-script", type=str, help="OpenSCAD script, required without --manifest")
+parser.add_argument("-P", "--parameter-set", type=str, help = "parameter set of the json file named as the script ('' for none), the target picture base name by default")
+parser.add_argument("-r","--resolution",type=str,help="target resolution in 'openscad' format i.e. 800x600, required without --manifest")
+parser.add_argument("--render", action='store_true', help = "for full geometry evaluation when exporting png, evaluated once in a mesh shared by every view unless the script sets $vp* variables (the mesh carries no colors)")
 parser.add_argument("--viewall", action='store_true', help = "adjust camera to fit object")
 parser.add_argument("--view", choices=['axes', 'crosshairs', 'edges', 'scales', 'wireframe'], help = "view options")
 parser.add_argument("--make-deps", type=str, help = "make dependency file creation")
+parser.add_argument("-o", "--output", type=str, help = "picture file written, the target picture when omitted")
+parser.add_argument("--native", action='store_true', help = "writes the supersampled rendering without downscaling it to resolution")
+parser.add_argument("-s", "--supersample", type=lambda value: value if value=='auto' else int(value), help = "supersample factor (1-4) or 'auto' for the lowest one similar to 4 within --supersample-threshold, calibrated once per picture", default=4)
+parser.add_argument("--supersample-threshold", type=int, help = "minimum similarity of the 'auto' supersample factor renderings", default=99)
+parser.add_argument("--views", type=str, help = "further 'output resolution [camera [projection]]' views of the same parameter set listed one per line in this manifest ('-' for stdin), '-' camera and projection default to the ones of the target picture. Views differing only by resolution share one rendering, other cameras evaluate the script again unless --render", metavar="MANIFEST")
+
+parser.add_argument("-m", "--manifest", type=str, help = "json manifest of the documentation pictures (see make-pictures.py) providing the options of the target picture, compared with the one in the git index unless 'native'")
+parser.add_argument(      "--threshold", type=int, help = "minimum similarity with the picture in the git index in --manifest mode", default=99)
 
 parser.add_argument("picture", type=str, help="Full target picture path")
 
-args = parser.parse_args()
+args  = parser.parse_args()
+entry = None
+if args.manifest:
+  entry = ofl.picture_entry(args.manifest,args.picture)
+  if entry is None:
+    parser.error(f"'{args.picture}' not declared in '{args.manifest}'")
+  # the command line options override the manifest ones
+  args  = parser.parse_args(ofl.picture_options(entry)+sys.argv[1:])
+if not args.ofl_script or not args.resolution:
+  parser.error("--ofl-script and --resolution are required without --manifest")
+# manifest mode, see make-pictures.py
+mode  = entry.get('mode','make') if entry else None
 
 ofl.verbosity   = args.verbosity
+ofl.cache       = ofl.Cache() if not args.no_cache else None
+meshes          = ofl.Meshes() if not args.no_cache else None
+samples         = ofl.Supersampling()
 
 ofl.info("Camera        : % s" %args.camera)
 ofl.info("Projection    : % s" %args.projection)
@@ -59,6 +121,7 @@ ofl.info("OSCAD         : % s" %ofl.oscad)
 ofl.info("Verbosity     : % s" %args.verbosity)
 ofl.info("Resolution    : % s" %args.resolution)
 ofl.info("View          : % s" %args.view)
+ofl.info("Supersample   : % s" %args.supersample)
 
 full    = os.path.normpath(args.ofl_script.removesuffix('.scad'))
 path    = os.path.dirname(full)
@@ -76,32 +139,154 @@ ofl.debug("scad : % s" %scad)
 full_target = os.path.normpath(args.picture.removesuffix('.png'))
 target_path = os.path.dirname(full_target)
 target_base = os.path.basename(full_target)
-png         = os.path.join(target_path,'unscaled-'+target_base+'.png')
+# compared pictures are rendered as 'new-' ones
+output      = args.output if args.output else os.path.join(target_path,'new-'+target_base+'.png') if mode in ('check','make') else args.picture
+shots       = [(output,args.resolution,args.camera,args.projection)]
+if args.views:
+  with (sys.stdin if args.views=='-' else open(args.views)) as manifest:
+    shots += list(views(manifest,args.camera,args.projection))
+# views differing only by resolution (same aspect ratio) share the rendering
+groups      = {}
+for shot in shots:
+  width, height = size(shot[1])
+  groups.setdefault((shot[2],shot[3],width/height),[]).append(shot)
+# private working directory (kept on failure), so concurrent invocations
+# never collide and supersampled renderings stay in memory when possible
+scratch_d   = ofl.workdir(target_base+'-',args.temp_root)
 
 ofl.debug("target path: % s" %target_path)
-ofl.debug("png        : % s" %png)
-
-parms = ['--imgsize',hires(args.resolution),'-o',png]
-if os.path.isfile(json):
-  parms += ['--p',json,'--P',target_base]
-if args.camera:
-  parms += ['--camera', args.camera]
-if args.projection:
-  parms += ['--projection', args.projection]
+ofl.debug("output     : % s" %output)
+ofl.debug("scratch    : % s" %scratch_d)
+
+p_name  = args.parameter_set if args.parameter_set is not None else target_base
+p_set   = ['--p',json,'--P',p_name] if p_name and os.path.isfile(json) else []
+make    = ['--m', 'make', '--d', os.path.join(scratch_d,'picture.deps')] if args.make_deps else []
+model   = p_set+make
+look    = []
 if args.render:
-  parms += ['--render']
+  look += ['--render']
 if args.viewall:
-  parms += ['--viewall']
+  look += ['--viewall']
 if args.view:
-  parms += ['--view', args.view]
-if args.make_deps:
-  parms += ['--m', 'make', '--d', args.make_deps]
-echo    = os.path.join(args.temp_root,base+'.echo')
-ofl.debug("command : % s" %parms)
+  look += ['--view', args.view]
+echo    = os.path.join(scratch_d,base+'.echo')
 ofl.debug("echo : % s" %echo)
 
-result  = ofl.openscad(scad,parms=parms,echo_f=echo,hw=True,dry_run=args.dry_run)
-if result.returncode!=0:
-  cprint(f'✝ ({result.returncode})','red')
-  cat(echo)
-  exit(result.returncode)
\ No newline at end of file
+def evaluate(scad_f, parms, fatal=True):
+  '''
+  runs OpenSCAD on «scad_f» exiting on failure, raising CalledProcessError
+  instead when not «fatal»
+  '''
+  ofl.debug("command : % s" %parms)
+  try:
+    result = ofl.openscad(scad_f,parms=parms,echo_f=echo,hw=True,dry_run=args.dry_run,target=ofl.relative(args.picture))
+  except subprocess.CalledProcessError as e:
+    if not fatal:
+      raise
+    result = e
+  if not args.dry_run and result.returncode!=0:
+    if not fatal:
+      raise subprocess.CalledProcessError(result.returncode,result.args,result.stdout,result.stderr)
+    cprint(f'✝ ({result.returncode})','red')
+    if os.path.isfile(echo):
+      cat(echo)
+    exit(result.returncode)
+
+def render(i, camera, projection, resolution, factor):
+  '''
+  renders the «i»-th group of views at «resolution» supersampled by «factor»,
+  returns the png file name
+  '''
+  png   = os.path.join(scratch_d,f'{i}-{factor}.png')
+  parms = ['--imgsize',hires(resolution,factor),'-o',png]
+  if camera:
+    parms += ['--camera', camera]
+  if projection:
+    parms += ['--projection', projection]
+  evaluate(source,parms+look+model)
+  return png
+
+def calibrate(reference, i, camera, projection, resolution):
+  '''
+  returns the lowest supersample factor rendering the «i»-th group of views
+  similar to the «reference» 4x one once downscaled to «resolution»
+  '''
+  if args.dry_run:
+    return 4
+  width, height = size(resolution)
+  downscale     = lambda png: images.gray(cv2.resize(cv2.imread(png),(width,height),interpolation=cv2.INTER_AREA))
+  expected      = downscale(reference)
+  for factor in range(1,4):
+    score = images.ssim(expected,downscale(render(i,camera,projection,resolution,factor)))
+    ofl.info(f"supersample {factor}x: {score}%")
+    if score>=args.supersample_threshold:
+      return factor
+  return 4
+
+success = False
+try:
+  source  = scad
+  deps    = None
+  if args.render and not args.dry_run and (meshes or len(groups)>1) and not viewport(scad):
+    # full geometry is evaluated just once exporting its mesh (reused from the
+    # mesh store when cached), then every view renders a wrapper importing it.
+    # The bare STL import drops the colors and any $vp* viewport of the scad:
+    # the latter keep evaluating the scad source for each group of views
+    try:
+      if meshes:
+        source, deps  = meshes.wrapper(scad,p_set,echo,ofl.relative(args.picture))
+      else:
+        evaluate(scad,['--export-format','binstl','-o',os.path.join(scratch_d,'mesh.stl')]+model,fatal=False)
+        source  = os.path.join(scratch_d,'mesh.scad')
+        with open(source,'w') as file:
+          file.write('import("mesh.stl");\n')
+      model   = []
+    except subprocess.CalledProcessError:
+      # i.e. no 3D geometry to export: every view evaluates the scad source
+      ofl.debug("mesh export failed")
+      source  = scad
+  # supersampling is calibrated on the first view when unknown
+  view    = ' '.join([args.resolution,args.camera if args.camera else '-',args.projection if args.projection else '-']+look)
+  factor  = 4 if args.native else args.supersample
+  if factor=='auto':
+    factor  = samples.factor(ofl.relative(args.picture),view)
+  for i, ((camera, projection, _), group) in enumerate(groups.items()):
+    resolution  = max((shot[1] for shot in group),key=lambda res: size(res)[0])
+    if factor is None:
+      png     = render(i,camera,projection,resolution,4)
+      factor  = calibrate(png,i,camera,projection,resolution)
+      samples.update(ofl.relative(args.picture),view,factor)
+      samples.save()
+    else:
+      png     = render(i,camera,projection,resolution,factor)
+    if args.dry_run:
+      continue
+    rendering = cv2.imread(png)
+    for o_file, res, _, _ in group:
+      width, height = size(res,args.native)
+      with ofl.atomic(o_file) as temp:
+        if (width,height)==(rendering.shape[1],rendering.shape[0]):
+          shutil.copyfile(png,temp)
+        else:
+          # area averaging downscale of the supersampled rendering
+          cv2.imwrite(temp,cv2.resize(rendering,(width,height),interpolation=cv2.INTER_AREA))
+  if args.make_deps and not args.dry_run:
+    # dependencies are written by OpenSCAD for the temporary rendering or the mesh
+    with ofl.atomic(args.make_deps) as temp:
+      ofl.write_deps(temp,args.picture,deps if deps is not None else ofl.read_deps(make[-1])[1])
+  success = True
+finally:
+  if success:
+    shutil.rmtree(scratch_d,ignore_errors=True)
+  else:
+    ofl.error(f"working files kept in '{scratch_d}'")
+
+if mode in ('check','make') and not args.dry_run:
+  # golden comparison with the picture in the git index, 'make' promotes
+  # dissimilar pictures while 'check' leaves them for inspection
+  with images.Golden() as store:
+    result = images.golden(args.picture,output,store.reference(args.picture),args.threshold,mode=='make')
+  if result['action']=='rejected':
+    cprint(f"✝ ({result.get('error',str(result.get('score'))+'% similarity')})",'red')
+    ofl.error(f"either correct the sources or commit '{output}'")
+    exit(1)
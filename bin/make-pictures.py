@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+#
+# documentation pictures build driver
+#
+# Builds the pictures declared in a json manifest, the only place where their
+# sources and rendering options are declared (the docs Makefiles build their
+# targets through it). The manifest is a list of objects with the following keys
+#
+# picture     - target picture path relative to the OFL root
+# scad        - OpenSCAD source
+# parameters  - parameter set of the json file with the same base name of the
+#               scad source (none when omitted)
+# size        - picture resolution (defaulted to the picture directory name)
+# camera      - OpenSCAD camera settings
+# projection  - 'ortho' or 'perspective'
+# view        - OpenSCAD view option (i.e. 'axes')
+# viewall     - when true the camera is adjusted to fit the object
+# render      - when true the full geometry is evaluated
+# supersample - supersample factor (1-4) or 'auto' (see make-picture.py)
+# mode        - 'make' (default) promotes dissimilar pictures, 'check' fails on
+#               them (both compare with the picture in the git index) while
+#               'native' writes the supersampled rendering without comparison
+#
+# Up to date pictures are skipped by content hash, the others are rendered and
+# compared on shared pools. Pictures differing only by camera, projection or
+# size are rendered by a single make-picture.py invocation through --views.
+#
+# This file is part of the 'OpenSCAD Foundation Library' (OFL) project.
+#
+# Copyright © 2021, Giampiero Gabbiani <giampiero@gabbiani.org>
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import ofl
+
+from concurrent.futures import ThreadPoolExecutor
+
+from termcolor import cprint
+
+import images
+
+def options(entry):
+  '''
+  returns the make-picture.py options for the manifest «entry»
+  '''
+  result  = ofl.picture_options(entry)
+  if args.supersample:
+    result += ['--supersample',args.supersample]
+  return result
+
+def shared(entry):
+  '''
+  returns what the manifest «entry» must share with the other pictures
+  rendered by the same make-picture.py invocation: views without camera or
+  projection only share with a first view without them.
+  '''
+  return (
+    entry['scad'],entry.get('parameters'),entry.get('view'),bool(entry.get('viewall')),bool(entry.get('render')),
+    entry.get('mode')=='native',entry.get('supersample'),bool(entry.get('camera')),bool(entry.get('projection'))
+  )
+
+def key(entry):
+  '''
+  returns the hash of the «entry» inputs: OpenSCAD version, picture options and
+  the content of the scad closure and of its json parameter sets when used
+  '''
+  scad    = os.path.join(ofl.path,entry['scad'])
+  json_f  = os.path.splitext(scad)[0]+'.json'
+  cmd     = [ofl.oscad_cmd,entry['picture'],entry.get('mode','make')]+options(entry)
+  if entry.get('parameters') and os.path.isfile(json_f):
+    cmd += ['--p',json_f]
+  return ofl.fingerprint(cmd+[scad])
+
+def output(entry):
+  '''
+  returns the file rendered for the manifest «entry»: the picture itself in
+  'native' mode, the 'new-' picture to be compared otherwise
+  '''
+  picture = os.path.join(ofl.path,entry['picture'])
+  return picture if entry.get('mode')=='native' else new(picture)
+
+def new(picture):
+  return os.path.join(os.path.dirname(picture),'new-'+os.path.basename(picture))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-m", "--manifest", type=str, help = "picture manifest", default=os.path.join(ofl.path,'pictures.json'))
+parser.add_argument("-j", "--jobs", type=int, help = "maximum number of concurrent renderings and comparisons", default=os.cpu_count())
+parser.add_argument("-f", "--force", action='store_true', help = "builds up to date pictures too")
+parser.add_argument(      "--no-cache", action='store_true', help = "always run OpenSCAD bypassing the result cache")
+parser.add_argument("-d", "--dry-run", action='store_true', help = "lists the pictures to be built without building them")
+parser.add_argument(      "--make-deps", action='store_true', help = "writes the make dependencies of each built picture in '<picture>.deps'")
+parser.add_argument("-t", "--threshold", type=int, help = "minimum threshold proving picture similarity", default=99)
+parser.add_argument("-s", "--supersample", type=str, help = "supersample factor (1-4) or 'auto' overriding the manifest ones")
+parser.add_argument("-v", "--verbosity", type=int, help = "Increase verbosity", choices=[ofl.SILENT,ofl.ERROR,ofl.WARN,ofl.INFO,ofl.DEBUG],default=ofl.ERROR)
+parser.add_argument("pictures", type=str, nargs='*', help="pictures or directories to build (relative to the OFL root), all the manifest when omitted")
+
+args = parser.parse_args()
+
+ofl.verbosity = args.verbosity
+
+with open(args.manifest) as file:
+  entries = json.load(file)
+if args.pictures:
+  selected  = [os.path.normpath(name) for name in args.pictures]
+  missing   = [name for name in selected if not any(entry['picture']==name or entry['picture'].startswith(name+os.sep) for entry in entries)]
+  if missing:
+    ofl.error(f"no picture declared in '{ofl.relative(args.manifest)}' for {', '.join(missing)}")
+    exit(1)
+  entries   = [entry for entry in entries if any(entry['picture']==name or entry['picture'].startswith(name+os.sep) for name in selected)]
+
+stamps    = ofl.Stamps()
+history   = ofl.History()
+keys      = {entry['picture']: key(entry) for entry in entries}
+stale     = [entry for entry in entries if args.force or not stamps.current(os.path.join(ofl.path,entry['picture']),keys[entry['picture']])]
+ofl.info(f"{len(entries)-len(stale)}/{len(entries)} pictures up to date")
+if args.dry_run:
+  for entry in stale:
+    print(entry['picture'])
+  exit(0)
+
+def render(group):
+  '''
+  renders the manifest entries of «group» (see shared()) from a single
+  make-picture.py invocation, the first one being its target picture and the
+  others its further --views. Returns the failed process or None.
+  '''
+  picture = os.path.join(ofl.path,group[0]['picture'])
+  cmd     = [sys.executable,os.path.join(ofl.path,'bin','make-picture.py')]+options(group[0])+['--output',output(group[0])]
+  views   = ''.join(f"{output(entry)} {entry.get('size',os.path.basename(os.path.dirname(output(entry))))} {entry.get('camera') or '-'} {entry.get('projection') or '-'}\n" for entry in group[1:])
+  if views:
+    cmd  += ['--views','-']
+  if args.no_cache:
+    cmd  += ['--no-cache']
+  if args.make_deps:
+    # the rule target is the picture name as make knows it in its directory
+    cmd  += ['--make-deps',os.path.basename(picture)+'.deps']
+  start   = time.monotonic()
+  result  = subprocess.run(cmd+[os.path.basename(picture)],cwd=os.path.dirname(picture),input=views,capture_output=True,text=True)
+  if result.returncode!=0:
+    return result
+  history.record('picture:'+group[0]['picture'],wall=time.monotonic()-start)
+  if args.make_deps:
+    # the views depend on the same files of the target picture
+    deps  = ofl.read_deps(picture+'.deps')[1]
+    for entry in group[1:]:
+      view  = os.path.join(ofl.path,entry['picture'])
+      with ofl.atomic(view+'.deps') as temp:
+        ofl.write_deps(temp,os.path.basename(view),deps)
+  return None
+
+def epilogue(entry, failure=None):
+  cprint(f"{entry['picture']}: ", 'yellow', end='')
+  if failure:
+    cprint(f'✝ ({failure})','red')
+  else:
+    cprint('✔','green')
+
+failed    = 0
+groups    = {}
+for entry in stale:
+  groups.setdefault(shared(entry),[]).append(entry)
+groups    = list(groups.values())
+# longest renderings first, unknown ones before all
+groups.sort(key=lambda group: history.estimate('picture:'+group[0]['picture'],default=float('inf')),reverse=True)
+with ThreadPoolExecutor(args.jobs) as pool:
+  results = [(entry,result) for group, result in zip(groups,pool.map(render,groups)) for entry in group]
+history.save()
+compared  = []
+for entry, result in results:
+  if result:
+    failed += 1
+    epilogue(entry,f'rendering failed ({result.returncode})')
+    print(result.stdout+result.stderr)
+  elif entry.get('mode')=='native':
+    stamps.update(os.path.join(ofl.path,entry['picture']),keys[entry['picture']])
+    epilogue(entry)
+  else:
+    compared.append(entry)
+
+# golden comparisons with the git index pictures through a single git process
+pictures  = [os.path.join(ofl.path,entry['picture']) for entry in compared]
+with images.Golden() as store:
+  for mode in ('check','make'):
+    group   = [(entry,picture) for entry, picture in zip(compared,pictures) if entry.get('mode','make')==mode]
+    triples = [(picture,new(picture),args.threshold) for _, picture in group]
+    for (entry, picture), result in zip(group,images.batch(triples,args.jobs,store=store,promote=mode=='make')):
+      if result['action']=='rejected':
+        failed += 1
+        epilogue(entry,result.get('error',f"{result.get('score')}% similarity, see '{ofl.relative(new(picture))}'"))
+      else:
+        stamps.update(picture,keys[entry['picture']])
+        epilogue(entry)
+stamps.save()
+cprint(f'{len(stale)-failed}/{len(stale)} pictures built', 'green' if not failed else 'red')
+exit(1 if failed else 0)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 #
-# some useful functions (mainly formatted output related)
+# some useful functions (mainly formatted output related) and OFL command line
+# tools (i.e. whole test suite execution)
 #
 # This file is part of the 'OpenSCAD Foundation Library' (OFL) project.
 #
@@ -9,8 +10,9 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 #
 
-import argparse, os, platform, re, subprocess, sys
+import argparse, collections, contextlib, dotenv, functools, hashlib, json, os, platform, re, runpy, selectors, shlex, signal, shutil, socket, subprocess, sys, tempfile, threading, time, traceback
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 from termcolor import colored, cprint
 
@@ -48,6 +50,33 @@ def rc_epilogue(rc):
     cprint(f'✝ ({rc})','red')
   return rc
 
+def workdir(prefix=None, root=None):
+  '''
+  returns a new private working directory inside «root», defaulted to the
+  tmpfs mount point when available and to the system temporary directory
+  otherwise
+  '''
+  if root is None:
+    root = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm',os.W_OK) else tempfile.gettempdir()
+  return tempfile.mkdtemp(prefix=prefix,dir=root)
+
+@contextlib.contextmanager
+def atomic(fname):
+  '''
+  yields a temporary name (same directory and suffix of «fname») atomically
+  renamed to «fname» when the block succeeds, removed otherwise
+  '''
+  fd, temp = tempfile.mkstemp(prefix='.'+os.path.basename(fname)+'.',suffix=os.path.splitext(fname)[1],dir=os.path.dirname(os.path.abspath(fname)))
+  os.close(fd)
+  try:
+    # same permissions of a newly created file
+    os.chmod(temp,0o666 & ~umask)
+    yield temp
+    os.replace(temp,fname)
+  finally:
+    if os.path.exists(temp):
+      os.remove(temp)
+
 def read_lines(fname):
   '''
   returns all «fname» lines
@@ -55,7 +84,96 @@ def read_lines(fname):
   with open(fname) as file:
     return file.readlines()
 
-def openscad(scad_f, parms=[], echo_f=None, hw=False, dry_run=False, must_fail=False):
+class Diagnostic(collections.namedtuple('Diagnostic','severity message file line')):
+  '''
+  OpenSCAD warning or error with its optional source location
+  '''
+  def __str__(self):
+    return f'{self.severity}: {self.message}'+(f' ({self.file}:{self.line})' if self.file else '')
+
+def scan(lines, first_error=False):
+  '''
+  yields the Diagnostic found in the «lines» iterable (i.e. an open file) one
+  line at a time, stopping at the first ERROR when «first_error» is set
+  '''
+  for line in lines:
+    match = diagnostic_re.match(line)
+    if match:
+      severity, message, file, line, detail = match.groups()
+      yield Diagnostic(severity,message+(': '+detail if detail else ''),file,int(line) if line else None)
+      if first_error and severity=='ERROR':
+        return
+
+def kill(proc):
+  '''
+  kills «proc» together with its process group
+  '''
+  try:
+    os.killpg(proc.pid,signal.SIGKILL)
+  except ProcessLookupError:
+    pass
+
+def killall():
+  '''
+  kills every OpenSCAD process started by execute() and still running
+  '''
+  for proc in processes.copy():
+    kill(proc)
+
+def execute(cmd, fail_fast=False, tail=200, timeout=None):
+  '''
+  runs «cmd» consuming its merged stdout/stderr while produced: only the last
+  «tail» lines are kept. With «fail_fast» the process is terminated at its
+  first ERROR. After «timeout» seconds the process is killed together with
+  its process group and the result is flagged as timed out.
+  '''
+  lines   = collections.deque(maxlen=tail)
+  start   = time.monotonic()
+  expired = threading.Event()
+  with subprocess.Popen(cmd,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,text=True,errors='replace',start_new_session=True) as proc:
+    processes.add(proc)
+    timer = threading.Timer(timeout,lambda: expired.set() or kill(proc)) if timeout else None
+    if timer:
+      timer.daemon = True
+      timer.start()
+    try:
+      for line in proc.stdout:
+        lines.append(line)
+        if fail_fast and line.startswith('ERROR:'):
+          os.killpg(proc.pid,signal.SIGTERM)
+          break
+      # reaping the child ourselves gives us its resource usage
+      _, status, usage  = os.wait4(proc.pid,0)
+      proc.returncode   = os.waitstatus_to_exitcode(status)
+    except BaseException:
+      # being in its own session OpenSCAD would survive us
+      kill(proc)
+      raise
+    finally:
+      processes.discard(proc)
+      if timer:
+        timer.cancel()
+  result          = subprocess.CompletedProcess(cmd,proc.returncode,''.join(lines),None)
+  result.cached   = False
+  result.timeout  = expired.is_set()
+  result.usage  = {
+    'wall': time.monotonic()-start,
+    'user': usage.ru_utime,
+    'sys':  usage.ru_stime,
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    'rss':  usage.ru_maxrss if platform.system()=='Darwin' else usage.ru_maxrss*1024
+  }
+  return result
+
+def openscad(scad_f, parms=[], echo_f=None, hw=False, dry_run=False, must_fail=False, fail_fast=False, target=None, timeout=None):
+  '''
+  runs OpenSCAD on «scad_f» returning a CompletedProcess enriched with the
+  list of Diagnostic found in the echo file (when «hw» is set) or in the
+  command output. With «hw» any diagnostic is a failure. OpenSCAD is killed
+  after «timeout» seconds keeping its partial echo.
+  Every run is recorded in the «metrics» file under the «target» name
+  (defaulted to the scad file and its parameter set).
+  '''
   scad_f  = os.path.normpath(scad_f)
   if echo_f is None:
     echo_f  = os.path.join(os.path.dirname(scad_f),os.path.splitext(os.path.basename(scad_f))[0]+'.echo')
@@ -69,17 +187,1375 @@ def openscad(scad_f, parms=[], echo_f=None, hw=False, dry_run=False, must_fail=F
   if dry_run:
     print(cmd)
   else:
-    result = subprocess.run(cmd,capture_output=True,text=True,check=not must_fail)
+    key     = cache.key(cmd) if cache else None
+    result  = cache.fetch(key,cmd) if key else None
+    if result is None:
+      if hw and os.path.isfile(echo_f):
+        # a previous run echo must never be taken for this one
+        os.remove(echo_f)
+      result = execute(cmd,fail_fast,timeout=timeout)
+      if key:
+        cache.store(key,cmd,result)
+    else:
+      debug("cache hit: % s" %key)
     debug("result: % s" %result)
-    if hw:
-      lines = read_lines(echo_f)
-      for line in lines:
-        # negative lookahead for excluding the useless 'Viewall and autocenter' warn
-        match   = re.findall(r"^(WARNING|ERROR): (?!Viewall and autocenter disabled in favor of \$vp\*)",line)
-        if match:
-          result.returncode = 1
+    if hw and not os.path.isfile(echo_f):
+      # OpenSCAD writes the echo file at the end: when terminated early (fail
+      # fast, timeout or signal) the output tail is all we have
+      with open(echo_f,'w') as file:
+        file.write(result.stdout)
+    if hw and os.path.isfile(echo_f):
+      with open(echo_f,errors='replace') as file:
+        result.diagnostics = list(scan(file,fail_fast))
+    else:
+      result.diagnostics = list(scan(result.stdout.splitlines(),fail_fast))
+    if metrics:
+      metrics.append(cmd,result,target)
+    if not must_fail and result.returncode!=0:
+      e = subprocess.CalledProcessError(result.returncode,cmd,result.stdout,result.stderr)
+      e.diagnostics, e.usage, e.cached, e.timeout = result.diagnostics, result.usage, result.cached, result.timeout
+      raise e
+    if hw and result.diagnostics:
+      result.returncode = 1
+    return result
+
+def outputs(cmd):
+  '''
+  returns the (option,file) couples of the files produced by the OpenSCAD
+  command «cmd» (exports and make dependency files)
+  '''
+  return [(cmd[i],cmd[i+1]) for i in range(len(cmd)-1) if cmd[i] in ('-o','--o','-d','--d')]
+
+def read_deps(fname):
+  '''
+  returns target and dependencies from the make dependency file «fname»
+  '''
+  with open(fname) as file:
+    # the first rule only, the others are the empty ones of write_deps()
+    rule = file.read().replace('\\\n',' ').partition('\n')[0]
+  target, _, deps = rule.partition(': ')
+  return target.strip(), deps.split()
+
+def write_deps(fname, target, deps):
+  '''
+  writes the make dependency file «fname» of «target» with an empty rule for
+  each of the «deps» (like 'gcc -MP'): deleted or renamed prerequisites don't
+  break the build
+  '''
+  with open(fname,'w') as file:
+    file.write(target+':'+''.join(' \\\n\t'+dep for dep in deps)+'\n')
+    file.write(''.join('\n'+dep+':\n' for dep in deps))
+
+@functools.cache
+def version():
+  '''
+  returns the OpenSCAD version string
+  '''
+  result = subprocess.run([oscad_cmd,'--version'],capture_output=True,text=True)
+  return (result.stdout+result.stderr).strip()
+
+@functools.cache
+def digest(fname, mtime, size):
+  # «mtime» and «size» are only used for invalidating the memoized value
+  with open(fname,'rb') as file:
+    return hashlib.sha256(file.read()).hexdigest()
+
+def file_digest(fname):
+  '''
+  returns the sha256 hex digest of «fname» or None when not existing
+  '''
+  try:
+    stat = os.stat(fname)
+  except OSError:
+    return None
+  return digest(os.path.realpath(fname),stat.st_mtime_ns,stat.st_size)
+
+@functools.cache
+def _references(fname, mtime, size):
+  with open(fname,errors='replace') as file:
+    return scad_refs.findall(file.read())
+
+def closure(scad_f):
+  '''
+  returns the transitive set of files referenced by «scad_f» through 'use',
+  'include' and 'import()' statements. References are resolved as OpenSCAD
+  does: from the referencing file directory first, then from OPENSCADPATH and
+  the OFL library root. Unresolved references are returned as they are.
+  '''
+  roots   = [d for d in os.environ.get('OPENSCADPATH','').split(os.pathsep) if d]+[str(lib)]
+  result  = set()
+  pending = [os.path.realpath(scad_f)]
+  while pending:
+    fname = pending.pop()
+    if fname in result:
+      continue
+    result.add(fname)
+    try:
+      stat = os.stat(fname)
+    except OSError:
+      continue
+    for use, imported in _references(fname,stat.st_mtime_ns,stat.st_size):
+      ref = use if use else imported
+      for d in [os.path.dirname(fname)]+roots:
+        candidate = os.path.realpath(os.path.join(d,ref))
+        if os.path.isfile(candidate):
+          break
+      else:
+        candidate = ref
+      pending.append(candidate)
+  return result
+
+def fingerprint(cmd):
+  '''
+  returns the hash identifying the results of the OpenSCAD command «cmd»: the
+  OpenSCAD version, the command parameters (output names excluded, -D
+  definitions like $fn/$fs/$fa included), the OPENSCADPATH and the content of
+  the scad source with its transitive closure and of the json parameter sets
+  '''
+  files   = {o_file for _, o_file in outputs(cmd)}
+  inputs  = closure(cmd[-1])
+  inputs.update(cmd[i+1] for i in range(len(cmd)-1) if cmd[i] in ('-p','--p'))
+  sha     = hashlib.sha256()
+  for token in [version(),os.environ.get('OPENSCADPATH','')]+cmd[1:-1]:
+    # only the output type is relevant, not its name
+    sha.update((os.path.splitext(token)[1] if token in files else token).encode()+b'\0')
+  for fname in sorted(inputs):
+    sha.update(f'{os.path.relpath(fname,path)}:{file_digest(fname)}'.encode()+b'\0')
+  return sha.hexdigest()
+
+class Cache:
+  '''
+  Content addressed store of OpenSCAD results. The key is a hash of the
+  OpenSCAD version, the command parameters (output names excluded), the
+  OPENSCADPATH and of the content of the scad source with its transitive
+  closure and of the json parameter sets. Each entry stores return code,
+  stdout/stderr, the exported files and the make dependencies, the least
+  recently used entries are evicted when exceeding «size» bytes.
+  '''
+  def __init__(self, root=None, size=None):
+    self.root = Path(root if root else state.joinpath('cache'))
+    self.size = size if size is not None else int(os.environ.get('OFL_CACHE_SIZE',1024))*1024*1024
+
+  def key(self, cmd):
+    return fingerprint(cmd)
+
+  def entry(self, key):
+    return self.root.joinpath(key[:2],key)
+
+  def fetch(self, key, cmd):
+    '''
+    replays the cached «key» entry producing the «cmd» outputs, returns the
+    cached result or None on miss
+    '''
+    entry = self.entry(key)
+    try:
+      with open(entry.joinpath('result.json')) as file:
+        data = json.load(file)
+    except (OSError, ValueError):
+      return None
+    cmd_outputs = outputs(cmd)
+    target      = next((o_file for option, o_file in reversed(cmd_outputs) if option in ('-o','--o')),None)
+    try:
+      for i, (option, o_file) in enumerate(cmd_outputs):
+        if option in ('-d','--d'):
+          write_deps(o_file,target,data['deps'])
+        else:
+          shutil.copyfile(entry.joinpath(str(i)),o_file)
+      os.utime(entry.joinpath('result.json'))
+    except OSError:
+      # entry evicted meanwhile
+      return None
+    result          = subprocess.CompletedProcess(cmd,data['returncode'],data['stdout'],data['stderr'])
+    result.cached   = True
+    result.timeout  = False
+    result.usage    = None
+    return result
+
+  def store(self, key, cmd, result):
+    # abnormal terminations (i.e. killed by a signal) are not cached
+    if result.returncode not in (0,1):
+      return
+    entry = self.entry(key)
+    tmp   = Path(f'{entry}.{os.getpid()}.{threading.get_ident()}')
+    data  = {'returncode': result.returncode, 'stdout': result.stdout, 'stderr': result.stderr, 'deps': []}
+    try:
+      os.makedirs(tmp)
+      for i, (option, o_file) in enumerate(outputs(cmd)):
+        if option in ('-d','--d'):
+          data['deps'] = read_deps(o_file)[1]
+        else:
+          shutil.copyfile(o_file,tmp.joinpath(str(i)))
+      with open(tmp.joinpath('result.json'),'w') as file:
+        json.dump(data,file)
+      os.rename(tmp,entry)
+    except OSError as e:
+      # missing outputs or concurrent store of the same entry
+      debug(f"cache store failed: {e}")
+      shutil.rmtree(tmp,ignore_errors=True)
+      return
+    self.evict()
+
+  def evict(self):
+    entries = []
+    for entry in self.root.glob('*/*'):
+      try:
+        entries.append((entry.joinpath('result.json').stat().st_mtime,sum(f.stat().st_size for f in entry.iterdir()),entry))
+      except OSError:
+        pass
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries, key=lambda e: e[0]):
+      if total<=self.size:
+        break
+      shutil.rmtree(entry,ignore_errors=True)
+      total -= size
+
+class Meshes:
+  '''
+  Store of the meshes fully evaluated by OpenSCAD, keyed by the fingerprint()
+  of their export command so that camera or resolution changes reuse them.
+  Each entry holds the binary STL, a wrapper scad importing it and the make
+  dependencies of the evaluation; the least recently used entries are evicted
+  when exceeding «size» bytes. The wrapper imports the bare STL: neither colors
+  nor $vp* viewport settings of the evaluated scad are carried over.
+  '''
+  def __init__(self, root=None, size=None):
+    self.root = Path(root if root else state.joinpath('meshes'))
+    self.size = size if size is not None else int(os.environ.get('OFL_CACHE_SIZE',1024))*1024*1024
+
+  def wrapper(self, scad_f, parms=[], echo_f=None, target=None):
+    '''
+    returns the wrapper scad importing the mesh of «scad_f» evaluated with the
+    «parms» OpenSCAD parameters (no outputs) and the dependencies of the
+    evaluation. On miss the mesh is exported running openscad() that raises
+    on failure; evaluations with diagnostics are not stored.
+    '''
+    entry   = self.root.joinpath(fingerprint([oscad_cmd,'--export-format','binstl','-o','mesh.stl']+parms+[os.path.normpath(scad_f)]))
+    scad    = entry.joinpath('mesh.scad')
+    try:
+      deps  = read_deps(entry.joinpath('mesh.deps'))[1]
+      os.utime(scad)
+      debug("mesh hit: % s" %entry)
+      return str(scad), deps
+    except OSError:
+      pass
+    tmp     = Path(f'{entry}.{os.getpid()}.{threading.get_ident()}')
+    os.makedirs(tmp)
+    try:
+      result  = openscad(scad_f,parms=['--export-format','binstl','-o',str(tmp.joinpath('mesh.stl')),'--m','make','--d',str(tmp.joinpath('mesh.deps'))]+parms,echo_f=echo_f,hw=True,target=target)
+      if result.returncode!=0:
+        raise subprocess.CalledProcessError(result.returncode,result.args,result.stdout,result.stderr)
+      deps    = read_deps(tmp.joinpath('mesh.deps'))[1]
+      with open(tmp.joinpath('mesh.scad'),'w') as file:
+        file.write('import("mesh.stl");\n')
+    except BaseException:
+      shutil.rmtree(tmp,ignore_errors=True)
+      raise
+    try:
+      os.rename(tmp,entry)
+    except OSError:
+      # concurrent store of the same entry
+      shutil.rmtree(tmp,ignore_errors=True)
+    self.evict()
+    return str(scad), deps
+
+  def evict(self):
+    entries = []
+    for entry in self.root.iterdir():
+      try:
+        entries.append((entry.joinpath('mesh.scad').stat().st_mtime,sum(f.stat().st_size for f in entry.iterdir()),entry))
+      except OSError:
+        pass
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries, key=lambda e: e[0]):
+      if total<=self.size:
+        break
+      shutil.rmtree(entry,ignore_errors=True)
+      total -= size
+
+def relative(fname):
+  '''
+  returns «fname» relative to the OFL root
+  '''
+  return os.path.relpath(os.path.realpath(fname),path)
+
+def echo_file(path,base,error=False):
+  '''
+  returns the echo file path for «base» in «path», the '-failed' variant when
+  «error» is set
+  '''
+  return os.path.join(path,base+('.echo' if not error else '-failed.echo'))
+
+def test_cases(lines):
+  '''
+  returns the TEST_CASE parameter set names found in the json «lines»
+  '''
+  result = []
+  for line in lines:
+    match   = re.findall('"TEST_CASE.*":',line)
+    if match:
+      # just one match for row so we take first occurrence
+      # stripping first one (") and last two (":) characters
+      result.append(str(match[0])[1:-2])
+  return result
+
+class Metrics:
+  '''
+  Append-only JSONL file with a record for every OpenSCAD run: wall time,
+  user/sys CPU and peak RSS of the OpenSCAD process, exit code, parameter set
+  and output sizes. Exceeding «size» bytes the file is rotated to a single
+  '.1' backup.
+  '''
+  def __init__(self, fname=None, size=None):
+    self.fname  = Path(fname if fname else state.joinpath('metrics.jsonl'))
+    self.size   = size if size is not None else int(os.environ.get('OFL_METRICS_SIZE',64))*1024*1024
+    self.lock   = threading.Lock()
+
+  def append(self, cmd, result, target=None):
+    p_set   = next((cmd[i+1] for i in range(len(cmd)-1) if cmd[i] in ('-P','--P')),None)
+    record  = {
+      'time':       time.time(),
+      'target':     target if target else relative(cmd[-1])+(f'[{p_set}]' if p_set else ''),
+      'scad':       relative(cmd[-1]),
+      'parameter_set': p_set,
+      'returncode': result.returncode,
+      'cached':     result.cached,
+      'timeout':    result.timeout,
+      'outputs':    {o_file: os.path.getsize(o_file) for _, o_file in outputs(cmd) if os.path.isfile(o_file)}
+    }
+    record.update(result.usage if result.usage else {})
+    with self.lock:
+      os.makedirs(self.fname.parent,exist_ok=True)
+      try:
+        if os.path.getsize(self.fname)>self.size:
+          os.replace(self.fname,f'{self.fname}.1')
+      except OSError:
+        pass
+      # a single write() on an O_APPEND file keeps lines whole among processes
+      with open(self.fname,'a') as file:
+        file.write(json.dumps(record)+'\n')
+
+  def records(self):
+    for fname in (f'{self.fname}.1',self.fname):
+      try:
+        with open(fname) as file:
+          for line in file:
+            try:
+              yield json.loads(line)
+            except ValueError:
+              pass
+      except OSError:
+        pass
+
+  def top(self, n=10, by='wall'):
+    '''
+    returns the «n» targets with the highest mean «by» value among their
+    uncached runs as (target,means,runs) tuples
+    '''
+    totals  = {}
+    for record in self.records():
+      if not record.get('cached') and by in record:
+        sums, runs = totals.get(record['target'],({},0))
+        for field in ('wall','user','sys','rss'):
+          sums[field] = sums.get(field,0)+record.get(field,0)
+        totals[record['target']] = (sums,runs+1)
+    means = [(target,{field: value/runs for field, value in sums.items()},runs) for target, (sums, runs) in totals.items()]
+    return sorted(means,key=lambda m: m[1][by],reverse=True)[:n]
+
+class Store:
+  '''
+  json file backed dictionary. Changes are merged with the file content when
+  saving, so that concurrent processes don't lose each other's records.
+  '''
+  def __init__(self, fname):
+    self.fname  = fname
+    self.lock   = threading.Lock()
+    self.added  = {}
+    self.data   = self.load()
+
+  def load(self):
+    try:
+      with open(self.fname) as file:
+        return json.load(file)
+    except (OSError, ValueError):
+      return {}
+
+  def merge(self, data, key, value):
+    data[key] = value
+
+  def save(self):
+    with self.lock:
+      if not self.added:
+        return
+      data  = self.load()
+      for key, value in self.added.items():
+        self.merge(data, key, value)
+      os.makedirs(os.path.dirname(self.fname), exist_ok=True)
+      tmp   = f'{self.fname}.{os.getpid()}'
+      with open(tmp, 'w') as file:
+        json.dump(data, file, indent=2, sort_keys=True)
+      os.replace(tmp, self.fname)
+      self.data, self.added = data, {}
+
+class History(Store):
+  '''
+  Persistent per target sample history (wall times and the like) used for
+  job ordering. Samples are stored in the form «key» → «metric» → [values]
+  retaining only the last «depth» values.
+  '''
+  def __init__(self, fname=None, depth=20):
+    self.depth  = depth
+    super().__init__(fname if fname else state.joinpath('history.json'))
+
+  def merge(self, data, key, metrics):
+    for metric, values in metrics.items():
+      data.setdefault(key, {})[metric] = (data.get(key, {}).get(metric, []) + values)[-self.depth:]
+
+  def record(self, key, **samples):
+    with self.lock:
+      for data in (self.data, self.added):
+        self.merge(data, key, {metric: [value] for metric, value in samples.items()})
+
+  def account(self, job):
+    '''
+    records wall time and peak RSS of the completed «job»: cache hits and
+    timeouts tell nothing about the job cost
+    '''
+    if not getattr(job.result,'cached',True) and not job.timed_out:
+      self.record(job.key, wall=job.result.usage['wall'], rss=job.result.usage['rss'])
+
+  def values(self, key, metric):
+    return self.data.get(key, {}).get(metric, [])
+
+  def estimate(self, key, metric='wall', default=None):
+    '''
+    returns the mean of the recorded «metric» values for «key» or «default»
+    when no sample is available
+    '''
+    values = self.values(key, metric)
+    return sum(values)/len(values) if values else default
+
+class Dependencies(Store):
+  '''
+  Persistent index of the files every job depends on in the form
+  «key» → [files], file names are relative to the OFL root.
+  '''
+  def __init__(self, fname=None):
+    super().__init__(fname if fname else state.joinpath('deps.json'))
+
+  def update(self, key, deps):
+    with self.lock:
+      self.data[key] = self.added[key] = sorted({relative(dep) for dep in deps})
+
+class Supersampling(Store):
+  '''
+  Persistent per picture supersample factors calibrated by make-picture.py in
+  the form «picture» → {'view': «view», 'factor': «factor»}, where «view»
+  describes the rendering settings the factor was calibrated for.
+  '''
+  def __init__(self, fname=None):
+    super().__init__(fname if fname else state.joinpath('supersampling.json'))
+
+  def factor(self, key, view):
+    '''
+    returns the factor calibrated for «key» with the same «view» settings,
+    None otherwise
+    '''
+    entry = self.data.get(key)
+    return entry['factor'] if entry and entry['view']==view else None
+
+  def update(self, key, view, factor):
+    with self.lock:
+      self.data[key] = self.added[key] = {'view': view, 'factor': factor}
+
+class Stamps(Store):
+  '''
+  Persistent content hashes of the built pictures in the form «picture» →
+  {'key': «inputs hash», 'digest': «picture hash»}: a picture is up to date
+  when both are unchanged. Picture names are relative to the OFL root.
+  '''
+  def __init__(self, fname=None):
+    super().__init__(fname if fname else state.joinpath('pictures.json'))
+
+  def current(self, picture, key):
+    entry = self.data.get(relative(picture))
+    return bool(entry) and entry['key']==key and entry['digest']==file_digest(picture)
+
+  def update(self, picture, key):
+    with self.lock:
+      self.data[relative(picture)] = self.added[relative(picture)] = {'key': key, 'digest': file_digest(picture)}
+
+def picture_entry(manifest, picture):
+  '''
+  returns the entry of «picture» in the json «manifest» of the documentation
+  pictures (see make-pictures.py), None when not declared
+  '''
+  with open(manifest) as file:
+    return next((entry for entry in json.load(file) if entry['picture']==relative(picture)),None)
+
+def picture_options(entry):
+  '''
+  returns the make-picture.py options rendering the manifest «entry»
+  '''
+  picture = path.joinpath(entry['picture'])
+  result  = ['--ofl-script',str(path.joinpath(entry['scad'])),'--resolution',entry.get('size',picture.parent.name),'--parameter-set',entry.get('parameters','')]
+  if entry.get('camera'):
+    result += ['--camera='+entry['camera']]
+  if entry.get('projection'):
+    result += ['--projection',entry['projection']]
+  if entry.get('view'):
+    result += ['--view',entry['view']]
+  if entry.get('viewall'):
+    result += ['--viewall']
+  if entry.get('render'):
+    result += ['--render']
+  if entry.get('supersample'):
+    result += ['--supersample',str(entry['supersample'])]
+  if entry.get('mode')=='native':
+    result += ['--native']
+  return result
+
+class Job:
+  '''
+  A single OpenSCAD invocation, «key» identifies it across runs (i.e. in the
+  History).
+  '''
+  def __init__(self, key, scad_f, parms=[], echo_f=None, must_fail=False, case=None, deps_f=None):
+    self.key        = key
+    self.scad_f     = scad_f
+    self.parms      = parms+(['-d',deps_f] if deps_f else [])
+    self.echo_f     = echo_f
+    self.deps_f     = deps_f
+    self.must_fail  = must_fail
+    self.case       = case
+    self.fail_fast  = False
+    self.timeout    = None
+    self.result     = None
+    self.wall       = None
+
+  @property
+  def timed_out(self):
+    return getattr(self.result,'timeout',False)
+
+  @property
+  def failed(self):
+    # an expected failure must not hang
+    return self.result is not None and (self.timed_out or not self.must_fail and self.result.returncode!=0)
+
+  @property
+  def outcome(self):
+    return None if self.result is None else 'timeout' if self.timed_out else 'failed' if self.failed else 'ok'
+
+  def report(self, e_file):
+    '''
+    dumps the failure of the job with its diagnostics and echo file «e_file»
+    '''
+    cprint(f'{self.key}: {self.result}', 'red')
+    for diagnostic in getattr(self.result,'diagnostics',[]):
+      cprint(f'{diagnostic}', 'red')
+    cat(e_file)
+
+def run(job, dry_run=False):
+  '''
+  executes «job» filling its result and wall time
+  '''
+  start = time.monotonic()
+  try:
+    job.result  = openscad(job.scad_f,parms=job.parms,echo_f=job.echo_f,hw=True,dry_run=dry_run,must_fail=job.must_fail,fail_fast=job.fail_fast,target=job.key,timeout=job.timeout)
+  except subprocess.CalledProcessError as e:
+    job.result  = e
+  job.wall  = time.monotonic() - start
+  return job
+
+class Timeouts:
+  '''
+  Per target timeouts derived from the recorded wall times: their 99th
+  percentile times «factor», never less than «floor» seconds. Targets without
+  history get «default» (no timeout when None).
+  '''
+  def __init__(self, history=None, factor=3, floor=60, default=None):
+    self.history  = history if history else History()
+    self.factor   = factor
+    self.floor    = floor
+    self.default  = default
+
+  def __call__(self, key):
+    values = sorted(self.history.values(key,'wall'))
+    if not values:
+      return self.default
+    p99 = values[min(len(values)-1,int(len(values)*.99))]
+    return max(self.floor,p99*self.factor)
+
+class Admission:
+  '''
+  Admits jobs while the projected memory of the running ones stays within
+  «budget» bytes (no limit when None). Each job need is its highest peak RSS
+  in «history», jobs without history are accounted a fair share of the
+  budget. With nothing running a job is always admitted, so that jobs larger
+  than the budget still run (alone).
+  '''
+  def __init__(self, budget=None, history=None, workers=None):
+    self.budget   = budget
+    self.history  = history if history else History()
+    self.default  = budget//(workers if workers else os.cpu_count()) if budget else 0
+    self.used     = 0
+    self.running  = 0
+
+  def need(self, key):
+    values = self.history.values(key,'rss')
+    return max(values) if values else self.default
+
+  def fits(self, key):
+    return self.budget is None or not self.running or self.used+self.need(key)<=self.budget
+
+  def admit(self, key):
+    need          = self.need(key)
+    self.used    += need
+    self.running += 1
+    return need
+
+  def release(self, need):
+    self.used    -= need
+    self.running -= 1
+
+def schedule(jobs, workers=None, history=None, done=None, dry_run=False, memory=None, timeouts=None):
+  '''
+  runs «jobs» on a pool of at most «workers» concurrent OpenSCAD processes
+  whose projected peak memory stays within «memory» bytes (see Admission).
+  Jobs are started longest first according to their «history» wall times,
+  jobs without history go first since they can be arbitrarily long; when the
+  next one doesn't fit the memory budget, smaller ones fill the spare
+  workers. «timeouts» (a Timeouts) assigns the jobs without an explicit
+  timeout. «done» is called (from the caller thread) for every completed job.
+  '''
+  history   = history if history else History()
+  workers   = workers if workers else os.cpu_count()
+  admission = Admission(memory,history,workers)
+  pending   = sorted(jobs, key=lambda job: history.estimate(job.key, default=float('inf')), reverse=True)
+  result    = list(pending)
+  for job in pending:
+    if timeouts and job.timeout is None:
+      job.timeout = timeouts(job.key)
+  running   = {}
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    try:
+      while pending or running:
+        while pending and len(running)<workers:
+          job = next((job for job in pending if admission.fits(job.key)),None)
+          if job is None:
+            break
+          pending.remove(job)
+          running[pool.submit(run, job, dry_run)] = (job,admission.admit(job.key))
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+          job, need = running.pop(future)
+          future.result()
+          admission.release(need)
+          if not dry_run:
+            history.account(job)
+          if done:
+            done(job)
+    except BaseException:
+      # in their own sessions the running OpenSCAD processes miss a terminal
+      # Ctrl-C, the pool shutdown would wait for them
+      killall()
+      raise
+  history.save()
+  return result
+
+class Test:
+  '''
+  OFL test made of a scad source with its optional .conf and .json companions.
+  Every TEST_CASE parameter set found in the json file is run as a separate
+  job writing its echo file inside the '<test>.echo/' directory.
+  '''
+  def __init__(self, full, camera=None, projection=None, must_fail=None):
+    full            = os.path.normpath(full.removesuffix('.scad'))
+    self.path       = os.path.dirname(full)
+    self.base       = os.path.basename(full)
+    self.conf       = os.path.join(self.path,self.base+'.conf')
+    self.json       = os.path.join(self.path,self.base+'.json')
+    self.scad       = os.path.join(self.path,self.base+'.scad')
+    self.must_fail  = must_fail if must_fail is not None else self.base.startswith(('error','warn'))
+    self.cases      = test_cases(read_lines(self.json)) if os.path.isfile(self.json) else []
+    self.command    = self.arguments(camera,projection)
+
+  def arguments(self, camera, projection):
+    dictionary  = dotenv.dotenv_values(self.conf) if os.path.isfile(self.conf) else {}
+    # CAMERA holds the make-test.py options passed by the test makefiles
+    parser      = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-c", "--camera")
+    parser.add_argument("-p", "--projection")
+    options, _  = parser.parse_known_args(shlex.split(dictionary.get('CAMERA') or ''))
+    camera      = camera      if camera     else options.camera     if options.camera     else dictionary.get('ARG_CAMERA')
+    projection  = projection  if projection else options.projection if options.projection else dictionary.get('ARG_PROJECTION')
+    result      = []
+    if camera:
+      result = result + ['--camera', camera]
+    if projection:
+      result = result + ['--projection', projection]
     return result
 
+  @property
+  def echo_dir(self):
+    return os.path.join(self.path,self.base+'.echo')
+
+  @property
+  def stale(self):
+    '''
+    true when the scad source is older than the conf, the default conf or the
+    templates it is generated from (see tests/defaults.mk)
+    '''
+    if not os.path.isfile(self.conf):
+      return False
+    sources = [self.conf,test_root.joinpath('defaults.conf')]+list(test_root.glob('template-*.scad'))
+    return not os.path.isfile(self.scad) or os.path.getmtime(self.scad)<max(os.path.getmtime(f) for f in sources)
+
+  def key(self, case=None):
+    key = os.path.relpath(self.scad, path)
+    return f'{key}[{case}]' if case else key
+
+  @property
+  def deps_f(self):
+    return os.path.join(self.path,self.base+'.deps')
+
+  def jobs(self, dry_run=False):
+    if not self.cases:
+      return [Job(self.key(),self.scad,self.command,echo_file(self.path,self.base),self.must_fail,deps_f=self.deps_f)]
+    if not os.path.exists(self.echo_dir) and not dry_run:
+      os.mkdir(self.echo_dir)
+    return [
+      Job(self.key(case),self.scad,self.command+['-p',self.json,'-P',case],echo_file(self.echo_dir,case[10:]),self.must_fail,case[10:],os.path.join(self.echo_dir,case[10:]+'.deps'))
+      for case in self.cases
+    ]
+
+  def record(self, jobs, index=None):
+    '''
+    records the OpenSCAD dependencies of the completed «jobs» in «index» and
+    writes the test make dependency file
+    '''
+    index = index if index is not None else Dependencies()
+    union = set()
+    for job in jobs:
+      if job.result is None or not os.path.isfile(job.deps_f):
+        continue
+      deps  = read_deps(job.deps_f)[1]+[f for f in (self.conf,self.json) if os.path.isfile(f)]
+      # absolute, since make includes the file from the test directory
+      deps  = {os.path.abspath(dep) for dep in deps}
+      index.update(job.key,deps)
+      union |= deps
+    if union:
+      write_deps(self.deps_f,self.base+'.echo',sorted(union))
+    index.save()
+
+  def failures(self, jobs):
+    '''
+    moves the echo files of the failed «jobs» to their '-failed' counterparts
+    and returns their new paths
+    '''
+    failed  = [job for job in jobs if job.failed]
+    if not failed:
+      return []
+    if self.cases:
+      e_dir = os.path.join(self.path,self.base+'-failed.echo')
+      if os.path.exists(e_dir):
+        shutil.rmtree(e_dir)
+      os.rename(self.echo_dir, e_dir)
+      return [echo_file(e_dir,job.case) for job in failed]
+    e_file  = echo_file(self.path,self.base,error=True)
+    if os.path.isfile(failed[0].echo_f):
+      os.rename(failed[0].echo_f, e_file)
+    else:
+      with open(e_file,'w') as file:
+        file.write(failed[0].result.stdout if failed[0].result else '')
+    return [e_file]
+
+def tests(dirs=None):
+  '''
+  returns all the '*-test.scad' found in the test directories
+  '''
+  dirs  = dirs if dirs else [test_root]+[test_root.joinpath(d) for d in ('artifacts','foundation','vitamins')]
+  return sorted(str(scad) for d in dirs for scad in Path(d).glob('*-test.scad'))
+
+def changes(rev):
+  '''
+  returns the files changed since git revision (or range) «rev»
+  '''
+  result = subprocess.run(['git','-C',str(path),'diff','--name-only',rev],capture_output=True,text=True,check=True)
+  return [str(path.joinpath(name)) for name in result.stdout.splitlines()]
+
+def select(changed, index=None):
+  '''
+  returns the tests (full path WITHOUT suffix) with a job depending on any of
+  the «changed» files, or never recorded
+  '''
+  index   = index if index is not None else Dependencies()
+  changed = {relative(fname) for fname in changed}
+  result  = []
+  for scad in tests():
+    test  = Test(scad)
+    keys  = [test.key(case) for case in test.cases] if test.cases else [test.key()]
+    if any(key not in index.data or changed.intersection(index.data[key]) for key in keys):
+      result.append(scad.removesuffix('.scad'))
+  return result
+
+def generate(tests):
+  '''
+  regenerates through make the stale sources of «tests», as the test makefiles
+  do before running them
+  '''
+  stale = [relative(test.scad) for test in tests if test.stale]
+  if stale:
+    info(f"regenerating {' '.join(stale)}")
+    # the root 'tests/%' rule takes existing sources as up to date: staleness
+    # is the one of the '%.scad' rule, so their rebuild is forced
+    subprocess.run(['make','--always-make','--no-print-directory','-C',str(path)]+stale,check=True)
+
+def collect(names=None, dry_run=False):
+  '''
+  returns the jobs of the «names» tests (all when None) mapped to their Test,
+  with their stale sources regenerated
+  '''
+  owner     = {}
+  selected  = [Test(name) for name in (names if names else tests())]
+  if not dry_run:
+    generate(selected)
+  for test in selected:
+    for job in test.jobs(dry_run):
+      owner[job] = test
+  return owner
+
+def shard(jobs, index, count, history=None):
+  '''
+  returns the «jobs» of shard «index» (1 based) out of «count». Jobs are
+  assigned longest first to the least loaded shard, balancing shards by their
+  «history» durations rather than by number; jobs without history weigh as the
+  median one. Nodes sharing the same history get disjoint shards.
+  '''
+  history   = history if history else History()
+  known     = sorted(d for d in (history.estimate(job.key) for job in jobs) if d is not None)
+  default   = known[len(known)//2] if known else 1
+  loads     = [0]*count
+  result    = []
+  for job in sorted(jobs, key=lambda job: (-history.estimate(job.key,default=default),job.key)):
+    i         = loads.index(min(loads))
+    loads[i] += history.estimate(job.key,default=default)
+    if i==index-1:
+      result.append(job)
+  return result
+
+def shard_spec(text):
+  '''
+  converts an 'i/n' shard specification in the (i,n) couple
+  '''
+  index, count = (int(n) for n in text.split('/'))
+  if not 1<=index<=count:
+    raise argparse.ArgumentTypeError(f"invalid shard '{text}'")
+  return index, count
+
+def job_epilogue(key, outcome, returncode=None, timeout=None):
+  cprint(f'{key}: ', 'yellow', end='')
+  if outcome=='timeout':
+    cprint(f'✝ (timeout after {timeout:.0f}s)','red')
+  else:
+    rc_epilogue(0 if outcome=='ok' else returncode)
+
+def conclude(owner, jobs):
+  '''
+  records dependencies and failures of the completed «jobs» (mapped to their
+  Test by «owner»), returns the number of failed tests
+  '''
+  selected  = list(dict.fromkeys(owner[job] for job in jobs))
+  index     = Dependencies()
+  for test in selected:
+    test.record([job for job in jobs if owner[job] is test],index)
+  failed    = [test for test in selected if any(job.failed for job in jobs if owner[job] is test)]
+  for test in failed:
+    t_jobs  = [job for job in jobs if owner[job] is test]
+    for job, e_file in zip([job for job in t_jobs if job.failed], test.failures(t_jobs)):
+      print()
+      job.report(e_file)
+  cprint(f'{len(selected)-len(failed)}/{len(selected)} tests passed', 'green' if not failed else 'red')
+  return len(failed)
+
+def suite(names=None, workers=None, dry_run=False, memory=None, timeouts=None, part=None):
+  '''
+  runs the «names» tests (all when None) in a single job pool, limited to the
+  «part» (index,count) shard when set. Returns the number of failed tests.
+  '''
+  owner = collect(names,dry_run)
+  jobs  = shard(owner.keys(),*part) if part else owner.keys()
+
+  def done(job):
+    if not dry_run:
+      job_epilogue(job.key,job.outcome,job.result.returncode,job.timeout)
+
+  jobs  = schedule(jobs, workers=workers, done=done, dry_run=dry_run, memory=memory, timeouts=timeouts)
+  return conclude(owner,jobs) if not dry_run else 0
+
+def address(text):
+  '''
+  converts 'host:port' or a Unix socket path in a (family,address) couple
+  '''
+  host, _, port = text.rpartition(':')
+  return (socket.AF_INET,(host,int(port))) if host and port.isdigit() else (socket.AF_UNIX,text)
+
+class Coordinator:
+  '''
+  Job queue served over a socket to workers pulling one job at a time per
+  slot: fast workers simply pull more (work stealing). The jobs of workers
+  hanging up are queued again. Every request line from a worker carries the
+  result of its previous job (null at first) and is answered with the next
+  job (null when everything is done). Results carry the job dependencies and
+  failed echo, the test bookkeeping is done here once all the jobs of «owner»
+  (mapping them to their Test) are completed.
+  '''
+  def __init__(self, owner, history=None, timeouts=None):
+    self.history    = history if history else History()
+    self.owner      = owner
+    self.pending    = collections.deque(sorted(owner, key=lambda job: self.history.estimate(job.key, default=float('inf')), reverse=True))
+    self.total      = len(self.pending)
+    self.timeouts   = timeouts
+    self.results    = {}
+    self.condition  = threading.Condition()
+
+  @property
+  def finished(self):
+    return len(self.results)==self.total
+
+  def handle(self, conn):
+    job = None
+    try:
+      with conn, conn.makefile('r') as reader:
+        for line in reader:
+          result = json.loads(line)['result']
+          with self.condition:
+            if result and job:
+              self.complete(result)
+            job = None
+            while not self.pending and not self.finished:
+              self.condition.wait()
+            job = self.pending.popleft() if self.pending else None
+          spec = {'test': os.path.relpath(job.scad_f,path), 'key': job.key, 'timeout': self.timeouts(job.key) if self.timeouts else None} if job else None
+          conn.sendall((json.dumps({'job': spec})+'\n').encode())
+          if not job:
+            break
+    except (OSError, ValueError) as e:
+      warn(f"worker lost: {e}")
+    finally:
+      with self.condition:
+        if job:
+          self.pending.appendleft(job)
+        self.condition.notify_all()
+
+  def complete(self, result):
+    self.results[result['key']] = result
+    if not result['cached'] and result['outcome']!='timeout' and result['wall'] is not None:
+      self.history.record(result['key'],wall=result['wall'],rss=result['rss'])
+    job_epilogue(result['key'],result['outcome'],result['returncode'],result['timeout'])
+    for diagnostic in result['diagnostics']:
+      cprint(f'  {diagnostic}','red')
+    self.condition.notify_all()
+
+  def serve(self, listen):
+    family, addr = address(listen)
+    if family==socket.AF_UNIX and os.path.exists(addr):
+      os.unlink(addr)
+    server = socket.socket(family,socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+    server.bind(addr)
+    server.listen()
+    server.settimeout(0.2)
+    info(f"coordinating {self.total} jobs on {listen}")
+    try:
+      while not self.finished:
+        try:
+          conn, _ = server.accept()
+        except socket.timeout:
+          continue
+        conn.settimeout(None)
+        threading.Thread(target=self.handle,args=(conn,),daemon=True).start()
+    finally:
+      server.close()
+      if family==socket.AF_UNIX:
+        os.unlink(addr)
+      self.history.save()
+    failed = [result for result in self.results.values() if result['outcome']!='ok']
+    cprint(f'{self.total-len(failed)}/{self.total} jobs passed', 'green' if not failed else 'red')
+    self.conclude()
+    return len(failed)
+
+  def conclude(self):
+    '''
+    settles the completed jobs as if run locally: their dependencies and
+    failed echo files are written before the usual conclusion
+    '''
+    jobs = [job for job in self.owner if job.key in self.results]
+    for job in jobs:
+      result            = self.results[job.key]
+      job.result        = subprocess.CompletedProcess([oscad_cmd]+job.parms+[job.scad_f],result['returncode'])
+      job.result.timeout      = result['outcome']=='timeout'
+      job.result.cached       = result['cached']
+      job.result.diagnostics  = result['diagnostics']
+      job.timeout       = result['timeout']
+      if result['deps'] is not None and job.deps_f:
+        write_deps(job.deps_f,os.path.basename(job.echo_f),result['deps'])
+      if result['echo'] is not None:
+        os.makedirs(os.path.dirname(job.echo_f),exist_ok=True)
+        with atomic(job.echo_f) as temp, open(temp,'w') as file:
+          file.write(result['echo'])
+    if jobs:
+      conclude(self.owner,jobs)
+
+def worker(connect, workers=None):
+  '''
+  pulls jobs from the coordinator listening on «connect» running them on
+  «workers» slots, returns the number of locally failed jobs. Dependencies
+  and failures are sent back to the coordinator doing their bookkeeping.
+  '''
+  workers = workers if workers else os.cpu_count()
+  family, addr = address(connect)
+  owner   = {}
+  jobs    = []
+  lock    = threading.Lock()
+
+  def find(spec):
+    with lock:
+      job = next((job for job in owner if job.key==spec['key']),None)
+      if job is None:
+        owner.update(collect([os.path.join(path,spec['test'])]))
+        job = next(job for job in owner if job.key==spec['key'])
+      jobs.append(job)
+    return job
+
+  def slot():
+    with socket.socket(family,socket.SOCK_STREAM) as conn, conn.makefile('r') as reader:
+      conn.connect(addr)
+      result = None
+      while True:
+        conn.sendall((json.dumps({'result': result})+'\n').encode())
+        reply = reader.readline()
+        spec  = json.loads(reply)['job'] if reply else None
+        if not spec:
+          return
+        job         = find(spec)
+        job.timeout = spec['timeout']
+        run(job)
+        usage   = getattr(job.result,'usage',None)
+        result  = {
+          'key':        job.key,
+          'outcome':    job.outcome,
+          'returncode': job.result.returncode,
+          'cached':     getattr(job.result,'cached',False),
+          'timeout':    job.timeout,
+          'wall':       usage['wall'] if usage else None,
+          'rss':        usage['rss'] if usage else None,
+          'diagnostics': [str(d) for d in getattr(job.result,'diagnostics',[])] if job.failed else [],
+          'deps':       read_deps(job.deps_f)[1] if job.deps_f and os.path.isfile(job.deps_f) else None,
+          'echo':       ''.join(read_lines(job.echo_f)) if job.failed and os.path.isfile(job.echo_f) else None
+        }
+
+  threads = [threading.Thread(target=slot) for _ in range(workers)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return sum(job.failed for job in jobs)
+
+def delegate(script):
+  '''
+  submits the execution of «script» (with the current command line arguments,
+  working directory and environment) to the resident 'ofl.py serve' daemon and
+  exits with its return code. Returns when no daemon is listening (or when
+  already executed by the daemon).
+  '''
+  if served or os.environ.get('OFL_SERVE')=='0':
+    return
+  client = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+  try:
+    client.connect(str(socket_path))
+  except OSError:
+    client.close()
+    return
+  request = {'script': os.path.abspath(script), 'argv': sys.argv[1:], 'cwd': os.getcwd(), 'env': dict(os.environ)}
+  sys.stdout.flush()
+  try:
+    socket.send_fds(client,[json.dumps(request).encode()+b'\n'],[0,1,2])
+    reply = client.makefile().readline()
+  except KeyboardInterrupt:
+    # hanging up drops the job on the daemon side
+    sys.exit(130)
+  except OSError:
+    reply = None
+  sys.exit(int(reply) if reply else 1)
+
+def terminate(signum, frame):
+  raise SystemExit(128+signum)
+
+def child(request, fds):
+  '''
+  daemon forked child executing a delegated script on the client standard
+  streams, never returns
+  '''
+  global served
+  code = 1
+  # terminated on client hangup: unwinding kills the OpenSCAD process groups
+  # (see execute()) that would survive in their own sessions otherwise
+  signal.signal(signal.SIGTERM,terminate)
+  signal.signal(signal.SIGINT,signal.SIG_DFL)
+  try:
+    for i, fd in enumerate(fds):
+      os.dup2(fd,i)
+      os.close(fd)
+    sys.stdin   = os.fdopen(0,'r',closefd=False)
+    sys.stdout  = os.fdopen(1,'w',closefd=False)
+    sys.stderr  = os.fdopen(2,'w',closefd=False)
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    configure()
+    sys.argv    = [request['script']]+request['argv']
+    sys.path[0] = os.path.dirname(request['script'])
+    served      = True
+    runpy.run_path(request['script'],run_name='__main__')
+    code = 0
+  except SystemExit as e:
+    if e.code is None or isinstance(e.code,int):
+      code = e.code if e.code else 0
+    else:
+      print(e.code,file=sys.stderr)
+  except BrokenPipeError:
+    # the client hung up
+    pass
+  except BaseException:
+    traceback.print_exc()
+  finally:
+    try:
+      sys.stdout.flush()
+      sys.stderr.flush()
+    except OSError:
+      pass
+    os._exit(code)
+
+def serve(workers=None, memory=None):
+  '''
+  resident daemon executing the scripts delegated by delegate() in forked
+  children: imports stay warm and no more than «workers» jobs run at once
+  no matter how many clients are waiting. Jobs are admitted within the
+  «memory» budget learning their peak RSS (OpenSCAD included) by target,
+  i.e. the last command line argument.
+  '''
+  workers   = workers if workers else os.cpu_count()
+  history   = History()
+  admission = Admission(memory,history,workers)
+  # warm up the modules needed by the client scripts
+  for module in ('cv2','numpy','images'):
+    try:
+      __import__(module)
+    except ImportError:
+      warn(f"{module} not available")
+  os.makedirs(os.path.dirname(socket_path),exist_ok=True)
+  if os.path.exists(socket_path):
+    os.unlink(socket_path)
+  server    = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+  server.bind(str(socket_path))
+  server.listen()
+  selector  = selectors.DefaultSelector()
+  selector.register(server,selectors.EVENT_READ)
+  pending   = collections.deque()
+  running   = {}
+  info(f"serving on {socket_path} with {workers} workers")
+  try:
+    while True:
+      for key, _ in selector.select(timeout=0.05):
+        if key.fileobj is server:
+          conn, _ = server.accept()
+          fds     = []
+          try:
+            # a stalled client can't hold the accept loop
+            conn.settimeout(ACCEPT_TIMEOUT)
+            data, fds, _, _ = socket.recv_fds(conn,1<<16,3)
+            while not data.endswith(b'\n'):
+              chunk = conn.recv(1<<16)
+              if not chunk:
+                break
+              data += chunk
+            request         = json.loads(data)
+            request['key']  = 'serve:'+relative(os.path.join(request['cwd'],request['argv'][-1] if request['argv'] else request['script']))
+            conn.settimeout(None)
+          except (OSError, ValueError, KeyError, TypeError) as e:
+            warn(f"bad request dropped ({e})")
+            for fd in fds:
+              os.close(fd)
+            conn.close()
+            continue
+          selector.register(conn,selectors.EVENT_READ)
+          pending.append((conn,request,fds))
+          debug(f"queued {request['script']} {request['argv']}")
+        else:
+          # a client hung up: drops its job
+          conn = key.fileobj
+          selector.unregister(conn)
+          for pid, job in list(running.items()):
+            if job[0] is conn:
+              os.kill(pid,15)
+          for job in [job for job in pending if job[0] is conn]:
+            pending.remove(job)
+            for fd in job[2]:
+              os.close(fd)
+          conn.close()
+      while pending and len(running)<workers:
+        job = next((job for job in pending if admission.fits(job[1]['key'])),None)
+        if job is None:
+          break
+        pending.remove(job)
+        conn, request, fds = job
+        pid = os.fork()
+        if pid==0:
+          # the client streams are all the child needs of the daemon
+          server.close()
+          conn.close()
+          for other, _, other_fds in pending:
+            other.close()
+            for fd in other_fds:
+              os.close(fd)
+          for other, *_ in running.values():
+            other.close()
+          child(request,fds)
+        for fd in fds:
+          os.close(fd)
+        running[pid] = (conn,request['key'],admission.admit(request['key']),time.monotonic())
+      while running:
+        pid, status, usage = os.wait4(-1,os.WNOHANG)
+        if pid==0:
+          break
+        conn, key, need, start = running.pop(pid)
+        admission.release(need)
+        history.record(key,wall=time.monotonic()-start,rss=usage.ru_maxrss if platform.system()=='Darwin' else usage.ru_maxrss*1024)
+        history.save()
+        if conn.fileno()!=-1:
+          selector.unregister(conn)
+          try:
+            conn.sendall(f'{os.waitstatus_to_exitcode(status)}\n'.encode())
+          except OSError:
+            # the client went away meanwhile
+            pass
+          conn.close()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    history.save()
+    server.close()
+    os.unlink(socket_path)
+
+def configure():
+  '''
+  sets the module state taken from the environment: called again by the
+  daemon children on the client environment
+  '''
+  global state, metrics, socket_path
+  state       = Path(os.environ.get('OFL_STATE', path.joinpath('.ofl')))
+  # an empty OFL_METRICS disables the run records
+  metrics     = Metrics(os.environ.get('OFL_METRICS')) if os.environ.get('OFL_METRICS')!='' else None
+  socket_path = Path(os.environ.get('OFL_SOCKET', state.joinpath('serve.sock')))
+
+def size(text):
+  '''
+  converts a size like '512M' or '8G' in bytes
+  '''
+  units = {'K': 1<<10, 'M': 1<<20, 'G': 1<<30, 'T': 1<<40}
+  text  = text.strip().upper().removesuffix('B')
+  return int(float(text[:-1])*units[text[-1]]) if text and text[-1] in units else int(text)
+
+def cat(f_name):
+  with open(f_name, errors='replace') as file:
+    shutil.copyfileobj(file,sys.stdout)
+  print()
+
+def timeout_arguments(parser):
+  '''
+  adds the adaptive timeout options to «parser»
+  '''
+  parser.add_argument("--timeout", type=float, help = "timeout in seconds for targets without duration history (none by default)")
+  parser.add_argument("--timeout-factor", type=float, help = "timeout as a multiple of the 99th percentile of the recorded durations (0 disables)", default=3)
+  parser.add_argument("--timeout-floor", type=float, help = "minimum timeout in seconds", default=60)
+
+def timeouts(args):
+  '''
+  returns the Timeouts for the options added by timeout_arguments()
+  '''
+  if not args.timeout_factor:
+    return Timeouts(factor=0,floor=args.timeout,default=args.timeout) if args.timeout else None
+  return Timeouts(factor=args.timeout_factor,floor=args.timeout_floor,default=args.timeout)
+
+def main(argv=None):
+  global cache, verbosity
+  parser = argparse.ArgumentParser(description="OFL command line tools")
+  parser.add_argument("-v", "--verbosity", type=int, help = "Increase verbosity", choices=[SILENT,ERROR,WARN,INFO,DEBUG],default=ERROR)
+  commands  = parser.add_subparsers(dest='command', required=True)
+
+  parser_test = commands.add_parser('test', help="runs tests on a bounded pool of OpenSCAD processes")
+  parser_test.add_argument("-d", "--dry-run", action='store_true', help = "On screen dump only of the OpenSCAD commands")
+  parser_test.add_argument("-j", "--jobs", type=int, help = "maximum number of concurrent OpenSCAD processes", default=os.cpu_count())
+  parser_test.add_argument("-m", "--memory", type=size, help = "memory budget (i.e. 8G) of the concurrent OpenSCAD processes", default=os.environ.get('OFL_MEMORY'))
+  parser_test.add_argument("--no-cache", action='store_true', help = "always run OpenSCAD bypassing the result cache")
+  timeout_arguments(parser_test)
+  parser_test.add_argument("--since", type=str, help = "runs only the tests depending on files changed since this git revision (or range)")
+  parser_test.add_argument("--shard", type=shard_spec, help = "runs only the i-th of n shares of the TEST_CASE jobs balanced by duration (nodes must share the same history)", metavar="i/n")
+  parser_test.add_argument("tests", type=str, nargs='*', help="Full test paths WITHOUT SUFFIX, all the tests when omitted")
+
+  parser_coordinator = commands.add_parser('coordinator', help="serves the test jobs to pulling workers")
+  parser_coordinator.add_argument("-l", "--listen", type=str, help = "'host:port' or Unix socket path", default=str(state.joinpath('queue.sock')))
+  parser_coordinator.add_argument("--since", type=str, help = "serves only the tests depending on files changed since this git revision (or range)")
+  timeout_arguments(parser_coordinator)
+  parser_coordinator.add_argument("tests", type=str, nargs='*', help="Full test paths WITHOUT SUFFIX, all the tests when omitted")
+
+  parser_worker = commands.add_parser('worker', help="runs the test jobs pulled from a coordinator")
+  parser_worker.add_argument("-c", "--connect", type=str, help = "coordinator 'host:port' or Unix socket path", default=str(state.joinpath('queue.sock')))
+  parser_worker.add_argument("-j", "--jobs", type=int, help = "maximum number of concurrent OpenSCAD processes", default=os.cpu_count())
+  parser_worker.add_argument("--no-cache", action='store_true', help = "always run OpenSCAD bypassing the result cache")
+
+  parser_serve  = commands.add_parser('serve', help="resident daemon executing the jobs submitted by make-test.py, make-picture.py, openscad.py and image-diff.py")
+  parser_serve.add_argument("-j", "--jobs", type=int, help = "maximum number of concurrent jobs", default=os.cpu_count())
+  parser_serve.add_argument("-m", "--memory", type=size, help = "memory budget (i.e. 8G) of the concurrent jobs", default=os.environ.get('OFL_MEMORY'))
+
+  parser_metrics = commands.add_parser('metrics', help="lists the most expensive OpenSCAD targets from the recorded metrics")
+  parser_metrics.add_argument("-n", "--top", type=int, help = "number of targets listed", default=10)
+  parser_metrics.add_argument("-b", "--by", choices=['wall','user','sys','rss'], help = "sort field", default='wall')
+
+  parser_select = commands.add_parser('select', help="lists the tests depending on changed files")
+  parser_select.add_argument("--since", type=str, help = "git revision (or range) the changes are taken from")
+  parser_select.add_argument("files", type=str, nargs='*', help="changed files")
+
+  args      = parser.parse_args(argv)
+  verbosity = args.verbosity
+  cache     = Cache() if not getattr(args,'no_cache',True) else None
+
+  if args.command=='test':
+    names = args.tests if not args.since else select(changes(args.since))
+    if args.since and not names:
+      info("no test affected")
+      return 0
+    return 1 if suite(names,workers=args.jobs,dry_run=args.dry_run,memory=args.memory,timeouts=timeouts(args),part=args.shard) else 0
+  elif args.command=='coordinator':
+    names = args.tests if not args.since else select(changes(args.since))
+    if args.since and not names:
+      info("no test affected")
+      return 0
+    return 1 if Coordinator(collect(names),timeouts=timeouts(args)).serve(args.listen) else 0
+  elif args.command=='worker':
+    return 1 if worker(args.connect,args.jobs) else 0
+  elif args.command=='serve':
+    signal.signal(signal.SIGTERM,signal.default_int_handler)
+    serve(args.jobs,args.memory)
+  elif args.command=='metrics':
+    print(f"{'wall (s)':>9} {'user (s)':>9} {'sys (s)':>9} {'rss (MiB)':>10} {'runs':>5}  target")
+    # records written before being disabled are still listed
+    for target, means, runs in (metrics if metrics else Metrics()).top(args.top,args.by):
+      print(f"{means['wall']:9.2f} {means['user']:9.2f} {means['sys']:9.2f} {means['rss']/(1<<20):10.1f} {runs:5}  {target}")
+  elif args.command=='select':
+    for name in select(args.files+(changes(args.since) if args.since else [])):
+      print(os.path.relpath(name))
+
 SILENT  = 0
 ERROR   = 1
 WARN    = 2
@@ -95,7 +1571,28 @@ oscad     = [
 ]
 path      = Path(__file__).parent.parent.absolute()
 lib       = path.joinpath('lib')
+test_root = path.joinpath('tests')
+# process umask, it can only be read by setting it
+umask     = os.umask(0o022)
+os.umask(umask)
+# OpenSCAD processes running in execute()
+processes = set()
+# OpenSCAD result cache, disabled when None
+cache     = None
+# persistent state (i.e. job history), OpenSCAD run records (disabled by an
+# empty OFL_METRICS) and 'ofl.py serve' daemon socket
+configure()
+# flag set when running inside the 'ofl.py serve' daemon
+served      = False
+# seconds a client has for sending its request to the daemon
+ACCEPT_TIMEOUT  = 2
+# OpenSCAD warnings and errors, excluding the useless 'Viewall and autocenter' warn
+diagnostic_re = re.compile(r'^(WARNING|ERROR): (?!Viewall and autocenter disabled in favor of \$vp\*)(.*?)(?:,? in file "?(.*?)"?, line (\d+)(?:: (.*?))?)?\s*$')
+# 'use <...>', 'include <...>' and 'import("...")' references
+scad_refs = re.compile(r'\b(?:use|include)\s*<([^>]+)>|\bimport\s*\(\s*(?:file\s*=\s*)?"([^"]+)"')
 
-# if __name__ == "__main__":
-#     import sys
-#     blah blah ...
\ No newline at end of file
+if __name__ == "__main__":
+  # enters through the 'ofl' module, so that its state is shared with any other
+  # module importing it
+  import ofl
+  sys.exit(ofl.main())
\ No newline at end of file
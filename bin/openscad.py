@@ -17,6 +17,9 @@ import re
 
 import ofl
 
+# hands over to the 'ofl.py serve' daemon when running
+ofl.delegate(__file__)
+
 from termcolor import colored, cprint
 
 parser = argparse.ArgumentParser()
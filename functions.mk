@@ -110,10 +110,21 @@ endef
 # $(2)=camera view settings
 # $(3)=projection type ('ortho' or 'perspective')
 # $(4)=other parameter(s)
-# $(5)=if set, the produced picture is renamed to
+# $(5)=if set, the produced picture name ('unscaled-'$@ otherwise)
 define make-native-picture
-	$(BIN)/make-picture.py --resolution $(1) $(if $(2),--camera=$(2)) $(if $(3),--projection=$(3)) --ofl-script $< --make-deps $@.deps $(4) $@
-	$(if $(5),mv unscaled-$@ $(5))
+	$(BIN)/make-picture.py --native --output $(if $(5),$(5),unscaled-$@) --resolution $(1) $(if $(2),--camera=$(2)) $(if $(3),--projection=$(3)) --ofl-script $< --make-deps $@.deps $(4) $@
+endef
+
+# Creates the target downscaled to the requested resolution as 'new-'$@.
+# SUPERSAMPLE overrides the default 4x supersample factor ('auto' calibrates
+# the lowest similar one once per picture).
+#
+# $(1)=target resolution in 'openscad' format i.e. 800x600
+# $(2)=camera view settings
+# $(3)=projection type ('ortho' or 'perspective')
+# $(4)=other parameter(s)
+define make-new-picture
+	$(BIN)/make-picture.py --output new-$@ $(if $(SUPERSAMPLE),--supersample $(SUPERSAMPLE)) --resolution $(1) $(if $(2),--camera=$(2)) $(if $(3),--projection=$(3)) --ofl-script $< --make-deps $@.deps $(4) $@
 endef
 
 # Creates the target and check the exact structural similarity with the one
@@ -124,6 +135,9 @@ endef
 # - rename the 'new-'$@ into $@
 # - commit the new target
 #
+# The version in the git index (as 'git checkout --' restored it) is read through
+# 'git cat-file' without locking the index, so concurrent checks don't serialize.
+#
 # NOTE: json file is expected to have a profile set with the same name of the
 # target.
 #
@@ -132,16 +146,13 @@ endef
 # $(3)=projection type ('ortho' or 'perspective')
 # $(4)=other parameter(s)
 define check-picture
-	$(call make-native-picture,$(1),$(2),$(3),$(4))
 	# creation of new-$@
-	$(IMCMD) unscaled-$@ -resize $(1) new-$@ &>/dev/null && rm unscaled-$@
-	# old creation from git or from current target when not existing
-	(git checkout -- $@ 2>/dev/null && mv $@ old-$@) || (test -f $@ && cp $@ old-$@) || true
-	# when no old version exists promote new
-	# when old exists: performs similarity test and
-	# if unsuccessful removes old leaving new and rising error
-	# otherwise removes new and promote old
-	(test ! -f old-$@ && mv new-$@ $@) || (($(IMG_DIFF) -v 0 old-$@ new-$@ || (rm old-$@ && echo "insufficient similariry either correct $? or commit new-$@" && false)) && rm -f new-$@ && mv old-$@ $@)
+	$(call make-new-picture,$(1),$(2),$(3),$(4))
+	# when no committed version exists promotes new
+	# when committed: performs similarity test and
+	# if unsuccessful removes $@ leaving new and rising error
+	# otherwise removes new and restores the committed one
+	$(IMG_DIFF) -v 0 --golden $@ new-$@ || (echo "insufficient similariry either correct $? or commit new-$@" && false)
 	$(call fix-target-dependencies)
 endef
 
@@ -157,14 +168,20 @@ endef
 # $(3)=projection type ('ortho' or 'perspective')
 # $(4)=other parameter(s)
 define make-picture
-	$(call make-native-picture,$(1),$(2),$(3),$(4))
-	$(BIN)/make-picture.py --resolution $(1) $(if $(2),--camera=$(2)) $(if $(3),--projection=$(3)) --ofl-script $< --make-deps $@.deps $(4) $@
-	$(IMCMD) unscaled-$@ -resize $(1) new-$@ &>/dev/null
-	rm -f unscaled-$@
-	(git checkout -- $@ 2>/dev/null && (($(IMG_DIFF) -v 0 $@ new-$@ || (echo -n "($<) " && false)) && rm new-$@ && touch $@)) || mv new-$@ $@
+	$(call make-new-picture,$(1),$(2),$(3),$(4))
+	$(IMG_DIFF) -v 0 --golden --promote $@ new-$@ || (echo -n "($<) " && false)
 	$(call fix-target-dependencies)
 endef
 
+# Builds the target through its pictures.json entry, the only declaration of the
+# documentation pictures sources, parameter sets, cameras and options (see
+# bin/make-pictures.py): prerequisites only are listed by the Makefiles. A
+# single make-picture.py process (delegated to the daemon when running) renders
+# and compares the picture, SUPERSAMPLE overrides the manifest factor.
+define manifest-picture
+	$(BIN)/make-picture.py --manifest $(PRJ_ROOT)/pictures.json $(if $(SUPERSAMPLE),--supersample $(SUPERSAMPLE)) --make-deps $@.deps $@
+endef
+
 # creates OpenSCAD camera settings for full view
 # $(1),$(2),$(3) translations
 # $(4),$(5),$(6) rotation
@@ -30,6 +30,7 @@ from time import *
 from set_config import *
 import json
 import re
+import symbols
 
 try:
     import parts
@@ -37,42 +38,101 @@ try:
 except:
     got_parts_py = False
 
-def find_scad_file(mname):
-    for filename in os.listdir(source_dir):
-        if filename[-5:] == ".scad":
-            #
-            # look for module which makes the assembly
-            #
-            with open(source_dir + "/" + filename, "r") as f:
-                for line in f.readlines():
-                    words = line.split()
-                    if len(words) and words[0] == "module":
-                        module = words[1].split('(')[0]
-                        if module == mname:
-                            return filename
-    return None
+def find_scad_file(mname, index = None):
+    #
+    # look for module which makes the assembly
+    #
+    found = (index or symbols.Index([source_dir])).find_module(mname)
+    return found[1] if found else None
 
 def main_assembly(target):
+    index = symbols.Index([source_dir])
     file = None
     if target:
         assembly = target + "_assembly"
-        file = find_scad_file(assembly)
+        file = find_scad_file(assembly, index)
     if not file:
         assembly = "main_assembly"
-        file = find_scad_file(assembly)
+        file = find_scad_file(assembly, index)
     if not file:
         raise Exception("can't find source for " + assembly)
     return assembly, file
 
+#
+# Tokens of the OpenSCAD literals echoed as BOM arguments: numbers, strings, names (true, false, undef and argument names)
+# and punctuation
+#
+token_re = re.compile(r"""\s*(?:(-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|([A-Za-z_$]\w*)|([\[\],=]))""")
+escape_re = re.compile(r'\\(.)')
+constants = {'true' : True, 'false' : False, 'undef' : None}
+parsed_args = {}
+part_re = re.compile(r'^(.*?\.stl|.*?\.dxf)\((.*)\)$')
+
+def tokenise(s):
+    tokens = []
+    pos = 0
+    s = s.rstrip()
+    while pos < len(s):
+        match = token_re.match(s, pos)
+        if not match:
+            raise Exception("Can't parse BOM arguments " + s)
+        tokens.append(match.groups())
+        pos = match.end()
+    return tokens
+
+def parse_value(tokens, i, s):
+    """ Parse the literal starting at tokens[i], return its value and the index of the next token. """
+    if i >= len(tokens):
+        raise Exception("Can't parse BOM arguments " + s)
+    number, string, name, punct = tokens[i]
+    if number:
+        return int(number) if number.lstrip('-').isdigit() else float(number), i + 1
+    if string:
+        return escape_re.sub(r'\1', string[1 : -1]), i + 1
+    if name in constants:
+        return constants[name], i + 1
+    if punct == '[':
+        vector = []
+        i += 1
+        while i < len(tokens) and tokens[i][3] != ']':
+            value, i = parse_value(tokens, i, s)
+            vector.append(value)
+            if i < len(tokens) and tokens[i][3] == ',':
+                i += 1
+        if i >= len(tokens):
+            raise Exception("Can't parse BOM arguments " + s)
+        return vector, i + 1
+    raise Exception("Can't parse BOM arguments " + s)
+
+def parse_args(s):
+    """ Parse OpenSCAD name=value arguments into a list of (name, value) pairs, the same arguments recur in each BOM. """
+    if s in parsed_args:
+        return parsed_args[s]
+    tokens = tokenise(s)
+    args = []
+    i = 0
+    while i < len(tokens):
+        if i + 1 >= len(tokens) or not tokens[i][2] or tokens[i + 1][3] != '=':
+            raise Exception("Can't parse BOM arguments " + s)
+        value, j = parse_value(tokens, i + 2, s)
+        args.append((tokens[i][2], value))
+        if j < len(tokens) and tokens[j][3] != ',':
+            raise Exception("Can't parse BOM arguments " + s)
+        i = j + 1
+    parsed_args[s] = args
+    return args
+
 class Part:
+    __slots__ = ['count', 'args']
+
     def __init__(self, args):
         self.count = 1
-        for arg in args:
-            arg = arg.replace('true',  'True').replace('false', 'False').replace('undef', 'None')
-            exec('self.' + arg)
+        self.args = args
 
     def data(self):
-        return self.__dict__
+        data = {'count' : self.count}
+        data.update(self.args)
+        return data
 
 class BOM:
     def __init__(self, name):
@@ -103,11 +163,11 @@ class BOM:
         }
 
     def add_part(self, s):
-        args = []
-        match = re.match(r'^(.*?\.stl|.*?\.dxf)\((.*)\)$', s)                             #look for name.stl(...) or name.dxf(...)
+        args = None
+        match = part_re.match(s)                                                        #look for name.stl(...) or name.dxf(...)
         if match:
             s = match.group(1)
-            args = [match.group(2)]
+            args = match.group(2)
         if s[-4:] == ".stl":
             parts = self.printed
         else:
@@ -118,16 +178,17 @@ class BOM:
         if s in parts:
             parts[s].count += 1
         else:
-            parts[s] = Part(args)
+            parts[s] = Part(parse_args(args) if args else [])
 
     def add_assembly(self, ass, args = []):
         if ass in self.assemblies:
             self.assemblies[ass].count += 1
         else:
             bom = BOM(ass)
-            for arg in args:
-                arg = arg.replace('true',  'True').replace('false', 'False').replace('undef', 'None')
-                exec('bom.' + arg, locals())
+            for name, value in args:
+                if not name in ['big', 'ngb', 'zoomed']:
+                    raise Exception("Unknown assembly argument " + name)
+                setattr(bom, name, value)
             self.assemblies[ass] = bom
 
     def make_name(self, ass):
@@ -228,22 +289,25 @@ class BOM:
             for ass in sorted(self.assemblies):
                 print("%3d %s" % (self.assemblies[ass].count, self.assemblies[ass].make_name(ass)), file=file)
 
+echo_re = re.compile(r'ECHO: "~(.*)"')
+assembly_re = re.compile(r'^(.*)\((.*)\)$')
+
 def parse_bom(file = "openscad.log", name = None):
+    """ Parse the BOM from the ECHO lines of a log file or of an iterable of lines, e.g. from openscad.run_lines(). """
     main = BOM(name)
     main.ordered_assemblies = []
     stack = []
-    prog = re.compile(r'^(.*)\((.*)\)$')
-    for line in open(file):
-        pos = line.find('ECHO: "~')
-        if pos > -1:
-            s = line[pos + 8 : line.rfind('"')]
+    for line in open(file) if isinstance(file, str) else file:
+        match = echo_re.search(line)
+        if match:
+            s = match.group(1)
             if s[-1] == '{':
                 ass = s[:-1]
                 args = []
-                match = prog.match(ass)                             #look for (...)
+                match = assembly_re.match(ass)                      #look for (...)
                 if match:
                     ass = match.group(1)
-                    args = match.group(2).split(',')
+                    args = parse_args(match.group(2))
                 if stack:
                     main.assemblies[stack[-1]].add_assembly(ass)    #add to nested BOM
                 stack.append(ass)
@@ -288,13 +352,13 @@ def boms(target = None):
             f.write("use <%s>\n" % scad_file)
             f.write("%s();\n" % assembly);
         #
-        # Run openscad
+        # Run openscad and parse its echo output while it evaluates, only the CSG tree is exported, to stdout and discarded
         #
-        openscad.run("-D", "$bom=2", "-D", "$preview=true", "-o", "openscad.echo", "-d", bom_dir + "/bom.deps", bom_maker_name)
-        os.remove(bom_maker_name)
+        lines = openscad.run_lines(["-D", "$bom=2", "-D", "$preview=true", "-o", "-", "--export-format", "csg", "-d", bom_dir + "/bom.deps", bom_maker_name])
         print("Generating bom ...", end=" ")
 
-        main = parse_bom("openscad.echo", assembly)
+        main = parse_bom(lines, assembly)
+        os.remove(bom_maker_name)
 
         main.print_bom(True, open(bom_dir + "/bom.txt","wt"))
 
@@ -27,11 +27,33 @@
 # It then sorts the triangles to start with the one with the lowest vertices first (comparing first vertex, second, then third)
 # This has no effect on the model but makes the STL consistent. I.e. it makes a canonical form.
 #
+# When NumPy is available the facets are parsed a chunk at a time into a structured array, sorted with lexsort and
+# written in bulk, otherwise a facet object per triangle is used. Both give exactly the same output.
+#
+# Binary STL files (NumPy only) stay binary and ascii ones can be converted to binary, in which case the facets are
+# ordered by their single precision vertices.
+#
 
 from __future__ import print_function
 
+import mmap
+import os
+import re
+import struct
 import sys
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+chunk_size = 1 << 22    # bytes read at a time
+write_size = 1 << 16    # facets written at a time
+
+binary_header = b'OpenSCAD_Model'.ljust(80, b'\0')
+if numpy is not None:
+    binary_facet = numpy.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+
 def cmz(x):
     ''' Convert "-0" to "0". '''
     return '0' if x == '-0' else x
@@ -105,13 +127,216 @@ class STL:
             print('endsolid OpenSCAD_Model', file=f)
         return mins, maxs
 
-def canonicalise(fname):
+def words(f):
+    ''' Yield the whitespace separated words of a binary file a chunk at a time. '''
+    tail = b''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            if tail:
+                yield [tail]
+            return
+        chunk = tail + chunk
+        tail = b''
+        lst = chunk.split()
+        if lst and not chunk[-1:].isspace():
+            tail = lst.pop()        # may continue in the next chunk
+        yield lst
+
+def lt(a, b):
+    ''' Vectorised lexicographic a < b of rows, as Python compares tuples. '''
+    result = numpy.zeros(len(a), dtype = bool)
+    for i in reversed(range(a.shape[1])):
+        result = (a[:, i] < b[:, i]) | ((a[:, i] == b[:, i]) & result)
+    return result
+
+def is_binary(head, size):
+    ''' A binary STL is an 80 byte header, a little endian facet count and 50 bytes per facet. '''
+    return size >= 84 and size == 84 + 50 * struct.unpack('<I', head[80 : 84])[0] and not head.startswith(b'solid OpenSCAD_Model')
+
+def facets_dtype(text_dtype):
+    return numpy.dtype([('normal', text_dtype, (3,)), ('vertices', text_dtype, (3, 3)), ('key', numpy.float64, (3, 3))])
+
+def read_ascii(f):
+    ''' Parse an OpenSCAD ascii STL file into a structured array of facets. '''
+    columns = [2, 3, 4, 8, 9, 10, 12, 13, 14, 16, 17, 18]   # normal and vertex words of each 21 word facet
+    chunks = []
+    stream = words(f)
+    buf = []
+    for lst in stream:
+        buf += lst
+        if len(buf) >= 2:
+            break
+    if buf[:2] != [b'solid', b'OpenSCAD_Model']:
+        print("Not an OpenSCAD ascii STL file")
+        sys.exit(1)
+    del buf[:2]
+    while True:
+        n = len(buf) // 21
+        rows = numpy.array(buf[: n * 21], dtype = bytes).reshape(n, 21)
+        del buf[: n * 21]
+        other = rows[:, 0] != b'facet'
+        if other.any():                     # endsolid
+            chunks.append(rows[: other.argmax(), columns])
+            break
+        chunks.append(rows[:, columns])
+        lst = next(stream, None)
+        if lst is None:
+            break
+        buf += lst
+
+    text = numpy.concatenate(chunks)
+    text[text == b'-0'] = b'0'
+    facets = numpy.empty(len(text), dtype = facets_dtype(text.dtype))
+    facets['normal'] = text[:, :3]
+    facets['vertices'] = text[:, 3:].reshape(-1, 3, 3)
+    facets['key'] = facets['vertices'].astype(numpy.float64)
+    return facets
+
+def read_binary(f):
+    ''' Read a binary STL file into a structured array of facets. '''
+    f.seek(84)
+    stl = numpy.fromfile(f, dtype = binary_facet)
+    facets = numpy.empty(len(stl), dtype = facets_dtype(numpy.float32))
+    facets['normal'] = stl['normal']
+    facets['vertices'] = stl['vertices']
+    facets['key'] = stl['vertices']
+    return facets
+
+def read_facets(fname, binary = False):
+    ''' Read an STL file into a structured array of facets in the canonical order of its output format, binary when the
+    file is binary or binary is requested, and return it with the format. '''
+    with open(fname, 'rb') as f:
+        if is_binary(f.read(84), os.fstat(f.fileno()).st_size):
+            facets = read_binary(f)
+            binary = True
+        else:
+            f.seek(0)
+            facets = read_ascii(f)
+    if binary:
+        facets['key'] = facets['key'].astype(numpy.float32) + numpy.float32(0)     # single precision without -0
+    #
+    # Rotate each facet to start with its smallest vertex, with the same comparisons as Facet for ascii. For binary it is
+    # the smallest rotation, so facets with repeated vertices are canonical too.
+    #
+    key = facets['key']
+    if binary:
+        rotations = [numpy.roll(key, -i, axis = 1).reshape(-1, 9) for i in range(3)]
+        first = numpy.zeros(len(facets), dtype = int)
+        smallest = rotations[0]
+        for i in (1, 2):
+            smaller = lt(rotations[i], smallest)
+            first[smaller] = i
+            smallest = numpy.where(smaller[:, None], rotations[i], smallest)
+    else:
+        v1, v2, v3 = key[:, 0], key[:, 1], key[:, 2]
+        first = numpy.where(lt(v1, v2), numpy.where(lt(v1, v3), 0, 2), numpy.where(lt(v2, v3), 1, 2))
+    order = (first[:, None] + numpy.arange(3)) % 3
+    rows = numpy.arange(len(facets))[:, None]
+    facets['vertices'] = facets['vertices'][rows, order]
+    facets['key'] = key[rows, order]
+    #
+    # Stable sort on the vertex strings (ascii) or values and then normals (binary), the first ordinate being the
+    # primary key
+    #
+    if binary:
+        columns = numpy.hstack([facets['key'].reshape(-1, 9), facets['normal'].astype(numpy.float32) + numpy.float32(0)])
+    else:
+        columns = facets['vertices'].reshape(-1, 9)
+    return facets[numpy.lexsort([columns[:, i] for i in reversed(range(columns.shape[1]))])], binary
+
+def facets_bounds(facets):
+    if not len(facets):
+        return [float('inf')] * 3, [float('-inf')] * 3
+    key = facets['key'].reshape(-1, 3)
+    return key.min(axis = 0).tolist(), key.max(axis = 0).tolist()
+
+def write_facets(facets, fname):
+    ''' Write facets as an OpenSCAD ascii STL file in bulk and return the bounds. '''
+    nl = os.linesep.encode()        # text mode line endings of STL.write()
+    tokens = numpy.empty((min(len(facets), write_size), 25), dtype = object)
+    tokens[:, 0] = b'  facet normal '
+    tokens[:, [2, 4, 8, 10, 14, 16, 20, 22]] = b' '
+    tokens[:, 6] = nl + b'    outer loop' + nl + b'      vertex '
+    tokens[:, [12, 18]] = nl + b'      vertex '
+    tokens[:, 24] = nl + b'    endloop' + nl + b'  endfacet' + nl
+    with open(fname, 'wb') as f:
+        f.write(b'solid OpenSCAD_Model' + nl)
+        for i in range(0, len(facets), write_size):
+            block = facets[i : i + write_size]
+            n = len(block)
+            tokens[:n, [1, 3, 5]] = block['normal']
+            tokens[:n, [7, 9, 11, 13, 15, 17, 19, 21, 23]] = block['vertices'].reshape(-1, 9)
+            f.write(b''.join(tokens[:n].ravel().tolist()))
+        f.write(b'endsolid OpenSCAD_Model' + nl)
+    return facets_bounds(facets)
+
+def write_binary(facets, fname):
+    ''' Write facets as a binary STL file and return the bounds. '''
+    stl = numpy.zeros(len(facets), dtype = binary_facet)
+    stl['normal'] = facets['normal'].astype(numpy.float32) + numpy.float32(0)
+    stl['vertices'] = facets['key']
+    with open(fname, 'wb') as f:
+        f.write(binary_header + struct.pack('<I', len(stl)))
+        stl.tofile(f)
+    return facets_bounds(facets)
+
+def mapped_bounds(mm):
+    if is_binary(mm[:84], len(mm)):
+        n = (len(mm) - 84) // 50
+        if not n:
+            return [float('inf')] * 3, [float('-inf')] * 3
+        if numpy is not None:
+            vertices = numpy.frombuffer(mm, dtype = binary_facet, count = n, offset = 84)['vertices']
+            try:
+                return vertices.min(axis = (0, 1)).tolist(), vertices.max(axis = (0, 1)).tolist()
+            finally:
+                del vertices    # the map can't be closed while exported to a view
+        vertices = [struct.unpack_from('<3f', mm, 96 + 50 * i + 12 * j) for i in range(n) for j in range(3)]
+    else:
+        vertices = re.findall(br'vertex\s+(\S+)\s+(\S+)\s+(\S+)', mm)
+        if numpy is not None and vertices:
+            vertices = numpy.array(vertices).astype(numpy.float64)
+            return vertices.min(axis = 0).tolist(), vertices.max(axis = 0).tolist()
+        vertices = [tuple(float(x) for x in v) for v in vertices]
+    if not vertices:
+        return [float('inf')] * 3, [float('-inf')] * 3
+    return [min(v[i] for v in vertices) for i in range(3)], [max(v[i] for v in vertices) for i in range(3)]
+
+def bounds(fname):
+    ''' Return the bounds of an STL file, reduced over its memory mapped vertices without parsing the facets. '''
+    with open(fname, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return [float('inf')] * 3, [float('-inf')] * 3  # empty files can't be mapped
+        mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    try:
+        mins, maxs = mapped_bounds(mm)
+    finally:
+        mm.close()
+    return [x + 0.0 for x in mins], [x + 0.0 for x in maxs]    # no -0
+
+def canonicalise(fname, binary = False):
+    ''' Canonicalise an STL file in place, converting it to binary if requested, and return its bounds. '''
+    if numpy is not None:
+        facets, binary = read_facets(fname, binary)
+        return write_binary(facets, fname) if binary else write_facets(facets, fname)
+    with open(fname, 'rb') as f:
+        if is_binary(f.read(84), os.fstat(f.fileno()).st_size):
+            print("NumPy is needed to canonicalise binary STL files")
+            sys.exit(1)
+    if binary:
+        print("NumPy is needed to write binary STL files")
+        sys.exit(1)
     stl = STL(fname)
     return stl.write(fname)
 
 if __name__ == '__main__':
-    if len(sys.argv) == 2:
-        canonicalise(sys.argv[1])
+    args = sys.argv[1:]
+    binary = args[:1] == ['-b']
+    if binary:
+        args = args[1:]
+    if len(args) == 1:
+        canonicalise(args[0], binary)
     else:
-        print("\nusage:\n\t c14n_stl file - Canonicalise an STL file created by OpenSCAD.")
+        print("\nusage:\n\t c14n_stl [-b] file - Canonicalise an STL file created by OpenSCAD, -b to convert it to binary.")
         sys.exit(1)
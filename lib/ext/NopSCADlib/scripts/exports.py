@@ -31,7 +31,8 @@ from deps import *
 from tmpdir import *
 import json
 import shutil
-from colorama import Fore, init
+import symbols
+from colorama import init
 
 def bom_to_parts(bom_dir, part_type, assembly = None):
     #
@@ -97,6 +98,7 @@ def make_parts(target, part_type, parts = None):
     # Read existing STL bounds
     #
     if part_type == 'stl':
+        binary = bool(os.getenv("NOPSCADLIB_BINARY_STL"))      # export binary STL files, about five times smaller
         bounds_fname = target_dir + '/bounds.json'
         try:
             with open(bounds_fname) as json_file:
@@ -104,52 +106,43 @@ def make_parts(target, part_type, parts = None):
         except:
             bounds_map = {}
     #
-    # Find all the scad files
+    # Find the scad files defining modules ending in _<part_type>
     #
     module_suffix = '_dxf' if part_type == 'svg' else '_' + part_type
-    for dir in source_dirs(bom_dir):
-        if targets and os.path.isdir(dir):
-            for filename in os.listdir(dir):
-                if targets and filename[-5:] == ".scad":
-                    #
-                    # find any modules ending in _<part_type>
-                    #
-                    with open(dir + "/" + filename, "r") as f:
-                        for line in f.readlines():
-                            words = line.split()
-                            if(len(words) and words[0] == "module"):
-                                module = words[1].split('(')[0]
-                                if module.endswith(module_suffix):
-                                    base_name = module[:-4]
-                                    part = base_name + '.' + part_type
-                                    if part in targets:
-                                        #
-                                        # Run openscad on the created file
-                                        #
-                                        part_file = target_dir + "/" + part
-                                        dname = deps_name(deps_dir, filename)
-                                        changed = check_deps(part_file, dname)
-                                        changed = times.check_have_time(changed, part)
-                                        if part_type == 'stl' and not changed and not part in bounds_map:
-                                            changed = Fore.CYAN + "No bounds" + Fore.WHITE
-                                        if changed:
-                                            print(changed)
-                                            #
-                                            # make a file to use the module
-                                            #
-                                            part_maker_name = tmp_dir + '/' + part_type + ".scad"
-                                            with open(part_maker_name, "w") as f:
-                                                f.write("include <NopSCADlib/global_defs.scad>\n")
-                                                f.write("use <%s/%s>\n" % (reltmp(dir, target), filename))
-                                                f.write("%s();\n" % module);
-                                            t = time.time()
-                                            openscad.run("-o", part_file, part_maker_name, "-D$bom=1", "-d", dname)
-                                            times.add_time(part, t)
-                                            if part_type == 'stl':
-                                                bounds = c14n_stl.canonicalise(part_file)
-                                                bounds_map[part] = bounds
-                                            os.remove(part_maker_name)
-                                        targets.remove(part)
+    index = symbols.Index(source_dirs(bom_dir))
+    for part in list(targets):
+        module = part[:-4] + module_suffix
+        found = index.find_module(module)
+        if found:
+            dir, filename, line_no = found
+            #
+            # Run openscad on the created file
+            #
+            part_file = target_dir + "/" + part
+            dname = deps_name(deps_dir, filename)
+            changed = check_deps(part_file, dname)
+            changed = times.check_have_time(changed, part)
+            if part_type == 'stl' and not changed and not part in bounds_map:
+                bounds_map[part] = c14n_stl.bounds(part_file)
+            if changed:
+                print(changed)
+                #
+                # make a file to use the module
+                #
+                part_maker_name = tmp_dir + '/' + part_type + ".scad"
+                with open(part_maker_name, "w") as f:
+                    f.write("include <NopSCADlib/global_defs.scad>\n")
+                    f.write("use <%s/%s>\n" % (reltmp(dir, target), filename))
+                    f.write("%s();\n" % module);
+                t = time.time()
+                export_format = ["--export-format", "binstl"] if part_type == 'stl' and binary else []
+                openscad.run("-o", part_file, part_maker_name, "-D$bom=1", "-d", dname, *export_format)
+                times.add_time(part, t)
+                if part_type == 'stl':
+                    bounds = c14n_stl.canonicalise(part_file, binary)
+                    bounds_map[part] = bounds
+                os.remove(part_maker_name)
+            targets.remove(part)
     #
     # Write new bounds file
     #
@@ -20,30 +20,59 @@
 #
 #! Run `openscad.exe` and capture `stdout` and `stderr` in `openscad.log` as well as printing to the console.
 #
+# The output can also be consumed a line at a time while OpenSCAD runs, e.g. to parse a BOM without an echo file.
+#
 from __future__ import print_function
 
-import subprocess, sys
+import os, subprocess, sys
 
-def run_list(args, silent = False, verbose = False):
+def run_lines(args, silent = False, verbose = False, log_name = "openscad.log"):
+    """ Start openscad and return a generator of its console output, a line at a time as it is produced, logged to
+    log_name unless None. Anything exported to stdout with "-o -" is discarded. Errors and warnings are printed and exit
+    when it finishes. """
     cmd = ["openscad"] + args + ["--hardwarnings"]
     if not silent:
         for arg in cmd:
             print(arg, end=" ")
         print()
-    with open("openscad.log", "w") as log:
-        rc = subprocess.call(cmd, stdout = log, stderr = log)
-    log_file = "openscad.echo" if "openscad.echo" in cmd else "openscad.log"
+    to_stdout = "-o" in args and args[args.index("-o") + 1] == "-"
+    null = open(os.devnull, "w")
+    process = subprocess.Popen(cmd, stdout = null if to_stdout else subprocess.PIPE, stderr = subprocess.PIPE if to_stdout else subprocess.STDOUT, universal_newlines = True)
+    null.close()
+    return lines(process, process.stderr if to_stdout else process.stdout, "openscad.echo" in cmd, verbose, log_name)
+
+def lines(process, pipe, echo_file, verbose, log_name):
     bad = False
-    for line in open(log_file, "rt"):
-        if verbose or 'ERROR:' in line or 'WARNING:' in line:
-            bad = True
-            print(line[:-1])
+    with open(log_name if log_name else os.devnull, "w") as log:
+        try:
+            for line in iter(pipe.readline, ''):
+                log.write(line)
+                yield line
+                if not echo_file and (verbose or 'ERROR:' in line or 'WARNING:' in line):
+                    bad = True
+                    print(line[:-1])
+        except GeneratorExit:                   # abandoned by the consumer
+            process.kill()
+            process.wait()
+            raise
+        finally:
+            pipe.close()
+    rc = process.wait()
+    if echo_file:
+        for line in open("openscad.echo", "rt"):
+            if verbose or 'ERROR:' in line or 'WARNING:' in line:
+                bad = True
+                print(line[:-1])
     if rc:
         sys.exit(rc)
 
     if bad:
         sys.exit(1)
 
+def run_list(args, silent = False, verbose = False):
+    for line in run_lines(args, silent, verbose):
+        pass
+
 def run(*args):
     run_list(list(args), False)
 
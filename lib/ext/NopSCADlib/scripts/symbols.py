@@ -0,0 +1,100 @@
+#
+# NopSCADlib Copyright Chris Palmer 2018
+# nop.head@gmail.com
+# hydraraptor.blogspot.com
+#
+# This file is part of NopSCADlib.
+#
+# NopSCADlib is free software: you can redistribute it and/or modify it under the terms of the
+# GNU General Public License as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# NopSCADlib is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with NopSCADlib.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+"""
+Index of the modules and functions defined in scad files, kept in symbols.json beside this script and only re-parsed
+for files whose modification time or size has changed.
+"""
+import json
+import os
+import tempfile
+
+index_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'symbols.json')
+
+def replace(src, dst):
+    """ Atomically replace dst with src, Python 2 lacks os.replace but os.rename replaces on POSIX. """
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+def parse(fname):
+    """ Find the modules and functions defined in a scad file with their line numbers. """
+    modules = {}
+    functions = {}
+    with open(fname, "rt") as f:
+        for line_no, line in enumerate(f, 1):
+            words = line.split()
+            if len(words) > 1:
+                if words[0] == "module":
+                    modules.setdefault(words[1].split('(')[0], line_no)
+                elif words[0] == "function":
+                    functions.setdefault(words[1].split('(')[0].split('=')[0], line_no)
+    return {"modules" : modules, "functions" : functions}
+
+class Index:
+    def __init__(self, dirs):
+        """ Index the scad files in dirs, the first definition found wins. """
+        try:
+            with open(index_name) as json_file:
+                files = json.load(json_file)
+        except:
+            files = {}
+        changed = False
+        self.modules = {}
+        self.functions = {}
+        for dir in dirs:
+            if os.path.isdir(dir):
+                for filename in sorted(os.listdir(dir)):
+                    if filename.endswith('.scad'):
+                        path = dir + '/' + filename
+                        st = os.stat(path)
+                        key = os.path.realpath(path)        # the same file whatever the current directory
+                        entry = files.get(key)
+                        if not entry or entry["mtime"] != st.st_mtime or entry["size"] != st.st_size:
+                            entry = parse(path)
+                            entry["mtime"], entry["size"] = st.st_mtime, st.st_size
+                            files[key] = entry
+                            changed = True
+                        for name, line_no in entry["modules"].items():
+                            self.modules.setdefault(name, (dir, filename, line_no))
+                        for name, line_no in entry["functions"].items():
+                            self.functions.setdefault(name, (dir, filename, line_no))
+        for path in list(files):
+            if not os.path.isfile(path):
+                del files[path]
+                changed = True
+        if changed:
+            fd, temp_name = tempfile.mkstemp(dir = os.path.dirname(index_name), prefix = '.symbols')
+            try:
+                with os.fdopen(fd, 'w') as outfile:
+                    json.dump(files, outfile, indent = 4, sort_keys = True)
+                replace(temp_name, index_name)
+            except:
+                os.remove(temp_name)
+                raise
+
+    def find_module(self, name):
+        """ Return the dir, filename and line number defining module name or None. """
+        return self.modules.get(name)
+
+    def find_function(self, name):
+        """ Return the dir, filename and line number defining function name or None. """
+        return self.functions.get(name)
@@ -37,6 +37,7 @@ import bom
 import shutil
 import re
 import copy
+import symbols
 from colorama import Fore
 from tmpdir import *
 
@@ -158,85 +159,84 @@ def views(target, do_assemblies = None):
                 print("Removing %s" % file)
                 os.remove(target_dir + '/' + file)
     #
-    # Find all the scad files
+    # Find the scad files defining modules with names ending in _assembly
     #
     main_blurb = None
     main_assembly, main_file = bom.main_assembly(target)
     pngs = []
-    for dir in source_dirs(bom_dir):
-        if os.path.isdir(dir):
-            for filename in os.listdir(dir):
-                if filename.endswith('.scad'):
-                    #
-                    # find any modules with names ending in _assembly
-                    #
-                    with open(dir + "/" + filename, "r") as f:
-                        lines = f.readlines()
-                    line_no = 0
-                    for line in lines:
-                        words = line.split()
-                        if len(words) and words[0] == "module":
-                            module = words[1].split('(')[0]
-                            if is_assembly(module):
-                                lc_module = module.lower()
-                                if lc_module in lc_assemblies:
-                                    real_name = assemblies[lc_assemblies.index(lc_module)]
-                                    #
-                                    # Scrape the assembly instructions
-                                    #
-                                    for ass in flat_bom:
-                                        if ass["name"] == real_name:
-                                            zoomed = ass['zoomed']
-                                            if not "blurb" in ass:
-                                                ass["blurb"] = blurb.scrape_module_blurb(lines[:line_no])
-                                            break
+    index = symbols.Index(source_dirs(bom_dir))
+    lc_modules = {}
+    for module in sorted(index.modules):
+        if is_assembly(module):
+            lc_modules.setdefault(module.lower(), module)
+    for real_name in assemblies:
+        module = lc_modules.get(real_name.lower())
+        if module:
+            dir, filename, line_no = index.find_module(module)
+            #
+            # Scrape the assembly instructions
+            #
+            for ass in flat_bom:
+                if ass["name"] == real_name:
+                    zoomed = ass['zoomed']
+                    if not "blurb" in ass:
+                        with open(dir + "/" + filename, "r") as f:
+                            lines = f.readlines()
+                        ass["blurb"] = blurb.scrape_module_blurb(lines[:line_no - 1])
+                    break
 
-                                    #
-                                    # Run openscad on the created file
-                                    #
-                                    dname = deps_name(deps_dir, filename)
-                                    for explode in [0, 1]:
-                                        #
-                                        # Generate png name
-                                        #
-                                        png_name = target_dir + '/' + real_name + '.png'
-                                        if not explode:
-                                            png_name = png_name.replace('_assembly', '_assembled')
-                                        pngs.append(png_name)
+            #
+            # Run openscad on the created file
+            #
+            dname = deps_name(deps_dir, filename)
+            for explode in [0, 1]:
+                #
+                # Generate png name
+                #
+                png_name = target_dir + '/' + real_name + '.png'
+                if not explode:
+                    png_name = png_name.replace('_assembly', '_assembled')
+                pngs.append(png_name)
 
-                                        if not do_assemblies or real_name in do_assemblies:
-                                            changed = check_deps(png_name, dname)
-                                            changed = times.check_have_time(changed, png_name)
-                                            changed = options.have_changed(changed, png_name)
-                                            tmp_name = tmp_dir + '/' + real_name + '.png'
-                                            if changed:
-                                                print(changed)
-                                                #
-                                                # make a file to use the module
-                                                #
-                                                png_maker_name = tmp_dir + '/png.scad'
-                                                with open(png_maker_name, "w") as f:
-                                                    f.write("include <NopSCADlib/global_defs.scad>\n")
-                                                    f.write("use <%s/%s>\n" % (reltmp(dir, target), filename))
-                                                    f.write("%s();\n" % module);
-                                                t = time.time()
-                                                target_def = ['-D$target="%s"' % target] if target else []
-                                                cwd_def = ['-D$cwd="%s"' % os.getcwd().replace('\\', '/')]
-                                                view_def = ['--viewall', '--autocenter'] if not (zoomed & (1 << explode)) else ['--camera=0,0,0,55,0,25,140']
-                                                openscad.run_list(["-o", tmp_name, png_maker_name] + options.list() + target_def + cwd_def + view_def + ["-D$pose=1", "-D$explode=%d" % explode, colour_scheme, "--projection=p", image_size, "-d", dname]);
-                                                times.add_time(png_name, t)
-                                                do_cmd(["magick", tmp_name, "-trim", "-resize", "1004x1004", "-bordercolor", background, "-border", "10", tmp_name])
-                                                update_image(tmp_name, png_name)
-                                                os.remove(png_maker_name)
-                                            tn_name = png_name.replace('.png', '_tn.png')
-                                            if mtime(png_name) > mtime(tn_name):
-                                                do_cmd(("magick "+ png_name + " -trim -resize 280x280 -background " + background + " -gravity Center -extent 280x280 -bordercolor " + background + " -border 10 " + tmp_name).split())
-                                                update_image(tmp_name, tn_name)
-                                    done_assemblies.append(real_name)
-                                else:
-                                    if module == main_assembly:
-                                        main_blurb = blurb.scrape_module_blurb(lines[:line_no])
-                        line_no += 1
+                if not do_assemblies or real_name in do_assemblies:
+                    changed = check_deps(png_name, dname)
+                    changed = times.check_have_time(changed, png_name)
+                    changed = options.have_changed(changed, png_name)
+                    tmp_name = tmp_dir + '/' + real_name + '.png'
+                    if changed:
+                        print(changed)
+                        #
+                        # make a file to use the module
+                        #
+                        png_maker_name = tmp_dir + '/png.scad'
+                        with open(png_maker_name, "w") as f:
+                            f.write("include <NopSCADlib/global_defs.scad>\n")
+                            f.write("use <%s/%s>\n" % (reltmp(dir, target), filename))
+                            f.write("%s();\n" % module);
+                        t = time.time()
+                        target_def = ['-D$target="%s"' % target] if target else []
+                        cwd_def = ['-D$cwd="%s"' % os.getcwd().replace('\\', '/')]
+                        view_def = ['--viewall', '--autocenter'] if not (zoomed & (1 << explode)) else ['--camera=0,0,0,55,0,25,140']
+                        openscad.run_list(["-o", tmp_name, png_maker_name] + options.list() + target_def + cwd_def + view_def + ["-D$pose=1", "-D$explode=%d" % explode, colour_scheme, "--projection=p", image_size, "-d", dname]);
+                        times.add_time(png_name, t)
+                        do_cmd(["magick", tmp_name, "-trim", "-resize", "1004x1004", "-bordercolor", background, "-border", "10", tmp_name])
+                        update_image(tmp_name, png_name)
+                        os.remove(png_maker_name)
+                    tn_name = png_name.replace('.png', '_tn.png')
+                    if mtime(png_name) > mtime(tn_name):
+                        do_cmd(("magick "+ png_name + " -trim -resize 280x280 -background " + background + " -gravity Center -extent 280x280 -bordercolor " + background + " -border 10 " + tmp_name).split())
+                        update_image(tmp_name, tn_name)
+            done_assemblies.append(real_name)
+    #
+    # The main assembly blurb when it isn't on the BOM
+    #
+    if not main_assembly.lower() in lc_assemblies:
+        found = index.find_module(main_assembly)
+        if found:
+            dir, filename, line_no = found
+            with open(dir + "/" + filename, "r") as f:
+                lines = f.readlines()
+            main_blurb = blurb.scrape_module_blurb(lines[:line_no - 1])
     #
     # Build the document
     #
@@ -1,3 +1,10 @@
+# OpenSCAD dependencies recorded by make-test.py: a change in any library file
+# reruns the tests depending on it.
+# NOTE: explicit wildcard expansion suppresses errors when no files are found
+include $(wildcard *.deps)
+# the including makefile keeps its own default goal
+.DEFAULT_GOAL :=
+
 # test execution
 error%-test.echo : error%-test.scad
 	$(call target-prologue)
@@ -9,9 +16,10 @@ warn%-test.echo : warn%-test.scad
 	. $(realpath $(@:.echo=.conf)) && $(BIN)/make-test.py --must-fail $$CAMERA $(<:.scad=)
 	$(call target-epilogue)
 
+# TEST_JOBS (when set) is the number of TEST_CASEs run concurrently by each test
 %.echo : %.scad
 	$(call target-prologue)
-	. $(realpath $*.conf) && $(BIN)/make-test.py $$CAMERA $*
+	. $(realpath $*.conf) && $(BIN)/make-test.py $(if $(TEST_JOBS),--jobs $(TEST_JOBS)) $$CAMERA $*
 	$(call target-epilogue)
 
 # source creation